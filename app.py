@@ -1,7 +1,12 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from core.llm_client import get_client
-from core.rag_bridge import build_vector_store, query_vector_store
-import pdfplumber  # 记得确保安装了这个库：pip install pdfplumber
+import tiktoken
+from core.llm_client import get_client, MODEL_NAME
+from core.rag_bridge import build_vector_store, query_vector_store, split_text
+from core.pdf_reader import MAX_PAGES, read_pdf_pages
+from core.semantic_cache import SemanticCache
 
 # --- 1. 核心变量初始化 ---
 if "messages" not in st.session_state:
@@ -10,6 +15,62 @@ if "messages" not in st.session_state:
 if "knowledge_base_ready" not in st.session_state:
     st.session_state.knowledge_base_ready = False  # 标记知识库是否已构建
 
+if "semantic_cache" not in st.session_state:
+    st.session_state.semantic_cache = SemanticCache()  # 检索结果缓存 (换文档时重建)
+
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = ""  # 滑出窗口的旧对话摘要
+    st.session_state.summary_upto = 0      # messages[:summary_upto] 已被摘要覆盖
+    st.session_state.summary_job = None    # 后台摘要任务 (future, 覆盖到的下标)
+
+
+def reset_chat():
+    """清空对话及其摘要"""
+    st.session_state.messages = []
+    st.session_state.history_summary = ""
+    st.session_state.summary_upto = 0
+    st.session_state.summary_job = None
+    # 快捷按钮的防连点状态跟着对话一起清掉：历史没了，"结果见上方" 也就不成立了
+    for key in ("last_action_ts", "last_action_prompt", "pending_action"):
+        st.session_state.pop(key, None)
+
+# --- 1.5 PDF 解析工具 ---
+DOC_PREVIEW_CHARS = 2000  # 侧边栏预览的字数上限
+
+def extract_pdf_text(file_bytes, progress_bar):
+    """逐页提取文本 (pdfplumber 兜底时多进程并行)，进度条占 0% - 50%"""
+    def on_progress(done, process_pages):
+        current_progress = int((done / process_pages) * 50)
+        progress_bar.progress(current_progress, text=f"正在读取第 {done}/{process_pages} 页...")
+
+    total_pages, pages_text = read_pdf_pages(file_bytes, MAX_PAGES, on_progress)
+
+    # 如果页数太多，已被强制截断
+    if total_pages > MAX_PAGES:
+        st.warning(f"⚠️ 文档过大 ({total_pages}页)，为防止服务器崩溃，仅读取前 {MAX_PAGES} 页。")
+
+    # 列表累积 + 一次 join，不用 text += page_text (二次方拷贝)；空白页 (扫描件) 直接跳过
+    parts = []
+    for page_text in pages_text:
+        if page_text:
+            parts.append(page_text)
+            parts.append("\n")
+    return "".join(parts)
+
+
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _cached_build(doc_hash, _chunks):
+    """
+    按文档哈希缓存入库结果：同一份文档 (跨会话) 只向量化一次；_chunks 不参与缓存键的哈希。
+    缓存过期 / 被淘汰后再次上传时，build_vector_store 按 doc_hash 生成的固定 ID 跳过已入库片段，不会重复写入。
+    """
+    result_msg = build_vector_store(_chunks, doc_hash=doc_hash)
+    # 失败时抛异常，st.cache_data 不缓存异常，下次还能重试
+    if not result_msg.startswith("✅"):
+        raise RuntimeError(result_msg)
+    return result_msg
+
+
 # --- 2. 侧边栏：文件上传功能 (RAG 升级版) ---
 with st.sidebar:
     st.header("📂 知识库挂载")
@@ -20,73 +81,72 @@ with st.sidebar:
     
     # 处理文件上传
     if uploaded_file is not None:
-        # 定义最大页数限制 (保护 2G 内存服务器)
-        MAX_PAGES = 50 
-        
         try:
             # 检查是否已经处理过这个文件，防止重复计算
-            if "last_uploaded" not in st.session_state or st.session_state.last_uploaded != uploaded_file.name:
+            # 按文件内容哈希判断：同名但改过的文件会重建，改名的同一文件直接跳过
+            file_bytes = uploaded_file.getvalue()
+            file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+            if st.session_state.get("last_uploaded_hash") != file_hash:
                 
                 # 1. 进度条组件
                 progress_bar = st.progress(0, text="正在启动文档解析引擎...")
-                text = ""
-                
-                with pdfplumber.open(uploaded_file) as pdf:
-                    total_pages = len(pdf.pages)
-                    # 如果页数太多，强制截断
-                    process_pages = min(total_pages, MAX_PAGES)
-                    
-                    if total_pages > MAX_PAGES:
-                        st.warning(f"⚠️ 文档过大 ({total_pages}页)，为防止服务器崩溃，仅读取前 {MAX_PAGES} 页。")
-                    
-                    # 2. 逐页读取并更新进度条
-                    for i in range(process_pages):
-                        page_text = pdf.pages[i].extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                        
-                        # 更新进度 (0% - 50%)
-                        current_progress = int((i / process_pages) * 50)
-                        progress_bar.progress(current_progress, text=f"正在读取第 {i+1}/{process_pages} 页...")
+
+                # 2. 逐页读取并更新进度条
+                text = extract_pdf_text(file_bytes, progress_bar)
                 
                 # 3. 构建向量库 (耗时操作)
                 if text:
                     progress_bar.progress(60, text="正在切分文本并构建向量索引 (这需要一点时间)...")
                     
-                    # 调用 core 里的函数
-                    result_msg = build_vector_store(text)
+                    # 先切好片段再整批入库，Embedding 按批处理而不是逐条
+                    chunks = split_text(text)
+                    try:
+                        result_msg = _cached_build(file_hash, chunks)
+                    except RuntimeError as e:
+                        result_msg = str(e)
                     
                     # 完成
                     progress_bar.progress(100, text="✅ 处理完成！")
                     st.success(result_msg)
                     
                     # 记录状态
-                    if result_msg.startswith("✅"):
+                    # 部分构建 (个别片段向量化失败被跳过) 时已入库的片段照样可以检索
+                    if result_msg.startswith(("✅", "⚠️ 知识库部分构建")):
                         st.session_state.knowledge_base_ready = True
                     else:
                         st.session_state.knowledge_base_ready = False
-                    st.session_state.doc_content = text # (可选：存原文以便查看，如果内存紧张可注释掉这行)
-                    st.session_state.last_uploaded = uploaded_file.name
+                    # 只保留开头一小段用于预览，全文常驻 session_state 会让每个会话多占几 MB
+                    st.session_state.doc_preview = text[:DOC_PREVIEW_CHARS]
+                    st.session_state.last_uploaded_hash = file_hash
+                    st.session_state.semantic_cache = SemanticCache()  # 知识库变了，旧的检索结果作废
                 
         except Exception as e:
             st.error(f"文档读取失败: {e}")
             st.session_state.knowledge_base_ready = False
     else:
-        # 如果用户移除文件，重置知识库状态
+        # 如果用户移除文件，重置知识库状态 (重新上传同一文件时需要重新挂载)
         st.session_state.knowledge_base_ready = False
+        st.session_state.pop("last_uploaded_hash", None)
+        st.session_state.pop("doc_preview", None)
+
+    if st.session_state.get("doc_preview"):
+        with st.expander("📄 文档预览"):
+            st.text(st.session_state.doc_preview)
 
     st.divider()
     
     # 强制清空按钮
     if st.button("🗑️ 清空对话 / 重置", type="primary", use_container_width=True):
-        st.session_state.messages = []
+        reset_chat()
         st.rerun()
 
 # --- 3. 基础 System Prompt 模板 ---
+# 固定不变 (不拼接参考资料、不带时间戳)，作为每次请求的稳定前缀，服务端的前缀 KV 缓存才能命中
 base_system_prompt = """
 你是一位工业维修专家。
 请基于以下【参考资料】回答用户问题。如果资料中没有答案，请使用你的专业知识补充，但要说明"资料中未提及"。
 """
+SYSTEM_MESSAGE = {"role": "system", "content": base_system_prompt}
 
 
 # --- 4. 主界面布局 ---
@@ -98,7 +158,97 @@ for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
 
-# --- 5. 处理聊天的函数 ---
+# --- 5. 历史记录裁剪 ---
+# 只原文发送最近 6 轮对话，更早的内容由模型压缩成一段摘要，避免每轮 prefill 随对话长度无限增长
+HISTORY_TURNS = 6
+
+SUMMARY_PROMPT = "请用一两句话概括以下工业维修对话的要点（设备、故障现象、已给出的结论），供后续对话参考，只输出摘要："
+
+
+@st.cache_resource
+def _summary_pool():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def _summarize(client, prior_summary, messages):
+    """后台线程里执行，不能访问 st.*"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if prior_summary:
+        transcript = f"已有摘要：{prior_summary}\n{transcript}"
+    response = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[{"role": "user", "content": f"{SUMMARY_PROMPT}\n{transcript}"}],
+        temperature=0.1,
+        max_tokens=200,
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+def _collect_summary():
+    """后台摘要完成后并入 session_state"""
+    job = st.session_state.summary_job
+    if job is None or not job[0].done():
+        return
+    future, upto = job
+    st.session_state.summary_job = None
+    try:
+        st.session_state.history_summary = future.result()
+        st.session_state.summary_upto = upto
+    except Exception as e:
+        print(f"对话摘要失败: {e}")
+
+
+def _schedule_summary(client):
+    """有消息滑出窗口时，在后台线程生成新摘要，不阻塞当前回答"""
+    messages = st.session_state.messages
+    upto = max(0, len(messages) - HISTORY_TURNS * 2)
+    if upto <= st.session_state.summary_upto or st.session_state.summary_job is not None:
+        return
+    future = _summary_pool().submit(
+        _summarize,
+        client,
+        st.session_state.history_summary,
+        messages[st.session_state.summary_upto:upto],
+    )
+    st.session_state.summary_job = (future, upto)
+
+
+# --- 5.5 参考资料按 token 预算截断 (中英文字符/ token 比例差很多，不能按字符数截) ---
+MODEL_CTX_TOKENS = 128000    # glm-4-flash 上下文窗口
+REPLY_RESERVE_TOKENS = 4096  # 给回答预留
+MAX_CTX_TOKENS = 8000        # 参考资料本身的上限，再多只会拉长 prefill
+
+
+@st.cache_resource
+def _get_encoder():
+    # cl100k_base 与 GLM 分词器不完全一致，但用来做预算估计足够
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def truncate_context(context, api_messages):
+    """按剩余窗口截断参考资料"""
+    enc = _get_encoder()
+    used_tokens = sum(len(enc.encode(m["content"])) for m in api_messages)
+    budget = min(MAX_CTX_TOKENS, MODEL_CTX_TOKENS - REPLY_RESERVE_TOKENS - used_tokens)
+    ids = enc.encode(context)
+    if len(ids) <= budget:
+        return context
+    return enc.decode(ids[:max(budget, 0)])
+
+
+def build_history():
+    """摘要 + 最近 HISTORY_TURNS 轮原文"""
+    _collect_summary()
+    messages = st.session_state.messages
+    # 摘要还没覆盖到的旧消息照常原文发送，不丢上下文
+    start = min(max(0, len(messages) - HISTORY_TURNS * 2), st.session_state.summary_upto)
+    history = messages[start:]
+    if st.session_state.history_summary:
+        history = [{"role": "system", "content": f"此前对话摘要：{st.session_state.history_summary}"}] + history
+    return history
+
+
+# --- 6. 处理聊天的函数 ---
 def handle_chat(user_input):
     # 1. 既然上面已经显示了历史，这里只需要显示"新的一轮"
     # A. 显示用户输入
@@ -111,25 +261,20 @@ def handle_chat(user_input):
         # 2. RAG 查询：从向量库中检索相关上下文
         context = ""
         if st.session_state.knowledge_base_ready:
-            context = query_vector_store(user_input, k=3)
+            context = query_vector_store(user_input, k=3, cache=st.session_state.semantic_cache)
         
-        # 3. 构建动态 System Prompt
+        # 3. 构造消息：固定系统设定 + 摘要 + 最近几轮历史
+        # 每轮都变的参考资料单独成一条消息，放在本轮提问之前，前面的部分保持前缀稳定
+        history = build_history()
+        api_messages = [SYSTEM_MESSAGE] + history[:-1]
+        if context:
+            context = truncate_context(context, [SYSTEM_MESSAGE] + history)
         if context:
-            final_system_content = f"""
-{base_system_prompt}
+            api_messages.append({"role": "system", "content": f"【参考资料】：\n{context}"})
+        api_messages.append(history[-1])
 
-【参考资料】：
-{context}
-"""
-        else:
-            final_system_content = base_system_prompt
-        
-        system_prompt = {"role": "system", "content": final_system_content}
-        
         # 4. 调用 AI
         client = get_client()
-        # 构造消息：系统设定 + 历史记录
-        api_messages = [system_prompt] + st.session_state.messages
         
         response = client.chat.completions.create(
             model="glm-4-flash",
@@ -140,33 +285,68 @@ def handle_chat(user_input):
         full_response = st.write_stream(response)
     
     st.session_state.messages.append({"role": "assistant", "content": full_response})
+    _schedule_summary(client)
 
 
-# --- 6. 快捷按钮区 ---
+# --- 7. 快捷按钮区 ---
+# (按钮文字, 发送给 AI 的提示词)
+QUICK_ACTIONS = [
+    ("伺服电机故障", "我的设备出现了【伺服电机故障】。请详细列出：硬件检查、电气检查、参数设置三方面的排查步骤。"),
+    ("通讯超时", "我的设备出现了【PLC通讯超时】。请详细列出：物理连接、网络配置、干扰排查三方面的排查步骤。"),
+    ("ABB机器人错误", "我的ABB机器人报错。请列出最常见的5个错误代码及其含义和解决办法。"),
+    ("编码器异常", "我的设备报【编码器故障】。请列出排查步骤（线路、电池、机械安装）。"),
+]
+
+QUICK_ACTION_COOLDOWN = 1.5  # 快捷按钮冷却时间 (秒)
+
 st.markdown("##### ⚡ 快速诊断通道")
-col1, col2, col3, col4 = st.columns(4)
+
+def _cooldown_left():
+    """距离冷却结束还剩多少秒 (<= 0 表示已经可以发送)"""
+    last_ts = st.session_state.get("last_action_ts", float("-inf"))
+    return QUICK_ACTION_COOLDOWN - (time.monotonic() - last_ts)
 
 def quick_action(prompt):
-    # 强制清空历史，防止串台
-    st.session_state.messages = []
+    # 防连点：冷却从上一次回答"完成"时算起，回答进行中不算冷却。
+    # 回答还在流式输出时再点一次会触发重跑、打断当前回答，这时时间戳还没写，新的点击照常处理，不会两头落空。
+    if _cooldown_left() > 0:
+        if prompt == st.session_state.get("last_action_prompt"):
+            # 同一个按钮刚答完，回答就在上面，重复点击不再重复请求
+            st.toast("该诊断刚刚完成，结果见上方", icon="✅")
+            return
+        # 换了别的按钮：记下来等冷却结束后的那次运行再发，不在这里 sleep 占住脚本线程
+        st.session_state.pending_action = prompt
+        st.toast("稍等…冷却结束后自动发送", icon="⏳")
+        return
+
+    # 强制清空历史，防止串台 (顺带清掉待发送的快捷指令)
+    reset_chat()
     # 强制刷新页面，让上面的历史记录区清空
     # 但为了能执行 handle_chat，我们需要一点小技巧：
     # 直接在这里调用 handle_chat，因为 session_state 已经清空，上面循环不会打印旧的
     handle_chat(prompt)
     # 注意：这里不需要 rerun，因为 handle_chat 会实时画出来
+    st.session_state.last_action_ts = time.monotonic()
+    st.session_state.last_action_prompt = prompt
 
-if col1.button("伺服电机故障", use_container_width=True):
-    quick_action("我的设备出现了【伺服电机故障】。请详细列出：硬件检查、电气检查、参数设置三方面的排查步骤。")
-
-if col2.button("通讯超时", use_container_width=True):
-    quick_action("我的设备出现了【PLC通讯超时】。请详细列出：物理连接、网络配置、干扰排查三方面的排查步骤。")
-
-if col3.button("ABB机器人错误", use_container_width=True):
-    quick_action("我的ABB机器人报错。请列出最常见的5个错误代码及其含义和解决办法。")
+@st.fragment(run_every=QUICK_ACTION_COOLDOWN / 3)
+def _pending_action_timer():
+    """只在有待发送的快捷指令时挂上：冷却一结束就触发整页重跑去发送，平时不轮询"""
+    if _cooldown_left() <= 0:
+        st.rerun()
 
-if col4.button("编码器异常", use_container_width=True):
-    quick_action("我的设备报【编码器故障】。请列出排查步骤（线路、电池、机械安装）。")
+clicked = None
+for col, (label, action_prompt) in zip(st.columns(len(QUICK_ACTIONS)), QUICK_ACTIONS):
+    if col.button(label, use_container_width=True):
+        clicked = action_prompt
+if clicked is not None:
+    quick_action(clicked)
+if (pending := st.session_state.get("pending_action")) is not None:
+    if _cooldown_left() <= 0:
+        quick_action(pending)
+    else:
+        _pending_action_timer()
 
-# --- 7. 底部输入框 ---
+# --- 8. 底部输入框 ---
 if user_input := st.chat_input("请输入具体故障现象，或上传文档后提问..."):
     handle_chat(user_input)
@@ -1,22 +1,46 @@
-import json
-import ast
-import random
+import asyncio
+import queue
+import threading
 import time
-import math  # 引入数学库来实现周期性波动
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import orjson
 import streamlit as st
 
+from core.chat_store import get_chat_store, window_messages
 from core.llm_client import get_client, MODEL_NAME
+from core.semantic_cache import SemanticCache, is_cacheable_command
 from core.tools import send_email_action
 from robot_controller import RobotController
 
 # --- 1. 初始化全局资源 ---
 client = get_client()
+chat_store = get_chat_store()
+if "session_id" not in st.session_state:
+    # 写进 URL 查询参数，刷新页面或服务重启后还能从 SQLite 接上之前的对话
+    st.session_state.session_id = st.query_params.get("sid") or uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
 if "controller" not in st.session_state:
     st.session_state.controller = RobotController(num_robots=5)
+    snapshot = chat_store.load_snapshot(st.session_state.session_id)
+    if snapshot:
+        st.session_state.controller.robots = snapshot
+if "command_cache" not in st.session_state:
+    # 指令缓存：一字不差的重复指令 (如快捷按钮) 直接复用上次的 tool_calls，不再请求模型；只用精确匹配这一级
+    st.session_state.command_cache = SemanticCache()
 if "last_alert_time" not in st.session_state:
-    st.session_state.last_alert_time = 0  # 记录上次报警时间戳（秒）
+    st.session_state.last_alert_time = float("-inf")  # 记录上次报警时间 (time.monotonic 秒)
+    st.session_state.alert_lock = threading.Lock()
+if "controller_version" not in st.session_state:
+    st.session_state.controller_version = 0  # 每次指令执行成功 +1，用来让状态缓存失效
 controller = st.session_state.controller
 
+# 模型只能调用这几个控制器方法：显式白名单 + 字典查表，避免用动态字符串反射到 __init__ 之类的属性上
+COMMAND_NAMES = ("startup_system", "emergency_stop", "adjust_speed", "reset_system")
+_DISPATCH = {name: getattr(controller, name) for name in COMMAND_NAMES}
+
 # --- 2. CSS 样式 (保持原样) ---
 st.markdown(
     """
@@ -35,216 +59,515 @@ st.markdown(
 )
 
 # --- 3. 工具定义 (保持原样) ---
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "startup_system",
-            "description": "一键启动机器人(自动重置+设速度)。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "robot_id": {"type": "integer"},
-                    "target_speed": {"type": "integer"},
+# 页面脚本每次重跑都会从头执行，放在 cache_resource 里只构建一次，之后所有重跑和会话共用同一份 (只读，不要修改)
+@st.cache_resource
+def _tools():
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": "startup_system",
+                "description": "一键启动机器人(自动重置+设速度)。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "robot_id": {"type": "integer"},
+                        "target_speed": {"type": "integer"},
+                    },
+                    "required": ["robot_id"],
                 },
-                "required": ["robot_id"],
             },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "emergency_stop",
-            "description": "紧急停止机器人。",
-            "parameters": {
-                "type": "object",
-                "properties": {"robot_id": {"type": "integer"}},
-                "required": ["robot_id"],
+        {
+            "type": "function",
+            "function": {
+                "name": "emergency_stop",
+                "description": "紧急停止机器人。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"robot_id": {"type": "integer"}},
+                    "required": ["robot_id"],
+                },
             },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "adjust_speed",
-            "description": "调整速度。",
-            "parameters": {
-                "type": "object",
-                "properties": {"robot_id": {"type": "integer"}, "speed": {"type": "integer"}},
-                "required": ["robot_id", "speed"],
+        {
+            "type": "function",
+            "function": {
+                "name": "adjust_speed",
+                "description": "调整速度。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"robot_id": {"type": "integer"}, "speed": {"type": "integer"}},
+                    "required": ["robot_id", "speed"],
+                },
             },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "reset_system",
-            "description": "重置系统。",
-            "parameters": {
-                "type": "object",
-                "properties": {"robot_id": {"type": "integer"}},
-                "required": ["robot_id"],
+        {
+            "type": "function",
+            "function": {
+                "name": "reset_system",
+                "description": "重置系统。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"robot_id": {"type": "integer"}},
+                    "required": ["robot_id"],
+                },
             },
         },
-    },
-]
+    ]
 
 
 # --- 4. 执行底层指令 (保持原样) ---
-def execute_command(func_name, args, status_container):
+# 中文输入法常把引号打成全角，统一换成 ASCII 引号
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def _loose_json(text):
+    """
+    先按标准 JSON 解析；失败再把全角 / 单引号统一成双引号重试 (模型偶尔输出 Python 风格的字典)；
+    还不行且装了 json5 时才交给 json5。全部失败抛出第一次的 JSONDecodeError。
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as first_error:
+        error = first_error
+    try:
+        return orjson.loads(text.translate(_SMART_QUOTES).replace("'", '"'))
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        import json5  # 可选依赖，只有前两次都失败时才导入
+    except ImportError:
+        raise error
+    try:
+        return json5.loads(text)
+    except ValueError:
+        raise error
+
+
+def _robot_id(args):
+    """按控制器同样的规则清洗 robot_id ("2" / 2 / " 2号" 都是 2)；不是已知机器人时返回 None"""
+    r_id = controller._clean_int(args.get("robot_id"))
+    return r_id if r_id in controller.robots else None
+
+
+def _resolve_command(func_name, args, status_container):
+    """解析参数并找到控制器方法，返回 (方法, 参数, 机器人 ID)；出错时返回 (None, 错误结果, None)"""
     status_container.write(f"⚙️ **执行**: `{func_name}` | `{args}`")
 
-    if isinstance(args, str):
-        try:
-            args = json.loads(args.replace("'", '"'))
-        except Exception:
-            try:
-                args = ast.literal_eval(args)
-            except Exception:
-                pass
+    # 参数由调用方解析好 (tool_call 在 run_tool_calls 里，内联 JSON 在 parse_inline_command 里)
+    if not isinstance(args, dict):
+        return None, {"success": False, "message": "参数格式错误"}, None
+
+    function_to_call = _DISPATCH.get(func_name)
+    if function_to_call is None:
+        return None, {"success": False, "message": "函数不存在"}, None
+    r_id = _robot_id(args)
+    if r_id is None:
+        return None, {"success": False, "message": "ID不存在"}, None
+    return function_to_call, args, r_id
+
+
+def encode_result(result):
+    """
+    工具结果编码：绝大多数失败结果只有 success / message 两个字段，直接套固定模板，
+    只对 message 做一次转义；带 data 的成功结果交给 orjson。
+    """
+    if isinstance(result, dict) and result.keys() == {"success", "message"}:
+        success = "true" if result["success"] else "false"
+        return f'{{"success":{success},"message":{orjson.dumps(result["message"]).decode()}}}'
+    return orjson.dumps(result).decode()
 
+
+def _finish_command(result):
+    if isinstance(result, dict) and result.get("success"):
+        st.session_state.controller_version += 1
+    return result
+
+
+def execute_command(func_name, args, status_container):
+    function_to_call, args, _ = _resolve_command(func_name, args, status_container)
+    if function_to_call is None:
+        return args
+    try:
+        return _finish_command(function_to_call(**args))
+    except Exception as e:
+        return {"success": False, "message": f"崩溃: {str(e)}"}
+
+
+async def aexecute_command(func_name, args, status_container, robot_locks):
+    """异步版本：控制器调用放进线程池，同一台机器人的指令串行，不同机器人之间并发"""
+    function_to_call, args, r_id = _resolve_command(func_name, args, status_container)
+    if function_to_call is None:
+        return args  # 校验失败的调用不碰控制器，也不需要加锁
     try:
-        if hasattr(controller, func_name):
-            function_to_call = getattr(controller, func_name)
-            return function_to_call(**args)
-        return {"success": False, "message": "函数不存在"}
+        # 按清洗后的 ID 加锁："2" / 2 / " 2" 是同一台机器人，共用一把锁
+        async with robot_locks[r_id]:
+            result = await asyncio.to_thread(function_to_call, **args)
+        return _finish_command(result)
     except Exception as e:
         return {"success": False, "message": f"崩溃: {str(e)}"}
 
 
+def parse_tool_arguments(tool_call):
+    """
+    解析单个 tool_call 的参数，返回 (参数, None)；解析失败返回 (None, 错误结果)。
+    流式输出被截断或模型写出畸形 JSON 时只让这一条调用失败，不影响同一轮的其他调用。
+    """
+    try:
+        args = _loose_json(tool_call["function"]["arguments"] or "{}")
+    except ValueError as e:
+        return None, {"success": False, "message": f"参数解析失败: {e}"}
+    if not isinstance(args, dict):
+        return None, {"success": False, "message": "参数格式错误"}
+    return args, None
+
+
+async def run_tool_calls(tool_calls, parsed_args, status_container):
+    """
+    并发执行一轮里的所有 tool_calls，结果按模型给出的顺序返回 (每个 tool_call 一条)。
+    parsed_args 是 parse_tool_arguments 的结果，解析失败的调用直接返回对应的错误结果。
+    同一台机器人上连续重复的调用 (函数名 + 参数完全一致) 只执行一次，结果分发给每个 tool_call_id；
+    中间夹了别的指令就不合并，保证最终状态和逐条执行一致。
+    """
+    robot_locks = defaultdict(asyncio.Lock)
+    unique = []          # 实际要执行的 (函数名, 参数)
+    slots = []           # 每个 tool_call 对应 unique 里的下标，解析失败的直接放错误结果
+    last_by_robot = {}   # robot_id -> (规范化键, unique 下标)
+    for tool_call, (args, error) in zip(tool_calls, parsed_args):
+        if error is not None:
+            slots.append(error)
+            continue
+        func_name = tool_call["function"]["name"]
+        key = (func_name, orjson.dumps(args, option=orjson.OPT_SORT_KEYS))
+        robot = _robot_id(args)
+        last = last_by_robot.get(robot)
+        if last is not None and last[0] == key:
+            slots.append(last[1])
+            continue
+        last_by_robot[robot] = (key, len(unique))
+        slots.append(len(unique))
+        unique.append((func_name, args))
+
+    results = await asyncio.gather(
+        *(
+            aexecute_command(func_name, args, status_container, robot_locks)
+            for func_name, args in unique
+        )
+    )
+    return [results[i] if isinstance(i, int) else i for i in slots]
+
+
+STREAM_MIN_CHARS = 8
+STREAM_MIN_INTERVAL = 0.05
+
+
+def stream_reply(messages, tool_calls_acc):
+    """
+    流式调用模型：分批产出文本给 st.write_stream 渲染，首批 token 到达就能看到输出；
+    tool_call 的增量按 index 拼接进 tool_calls_acc，等流结束后再统一解析参数。
+    """
+    response = client.chat.completions.create(
+        model=MODEL_NAME,
+        # 下划线开头的是本地标记字段，不发给接口
+        messages=[
+            {k: v for k, v in m.items() if not k.startswith("_")} for m in messages
+        ],
+        tools=_tools(),
+        tool_choice="auto",
+        stream=True,
+    )
+    buffer = []
+    pending = 0
+    last_flush = time.monotonic()
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        for tc in delta.tool_calls or ():
+            slot = tool_calls_acc.setdefault(
+                tc.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function is not None:
+                slot["function"]["name"] += tc.function.name or ""
+                slot["function"]["arguments"] += tc.function.arguments or ""
+        if delta.content:
+            buffer.append(delta.content)
+            pending += len(delta.content)
+            now = time.monotonic()
+            # 节流：攒够 8 个字符且距上次刷新超过 50ms 才交给前端，避免每个 token 一条消息
+            if pending >= STREAM_MIN_CHARS and now - last_flush >= STREAM_MIN_INTERVAL:
+                yield "".join(buffer)
+                buffer.clear()
+                pending = 0
+                last_flush = now
+    if buffer:
+        yield "".join(buffer)
+
+
+def lookup_command_cache(prompt):
+    """
+    只按原文精确匹配，返回命中的 (content, tool_calls) 或 None。
+    指令有副作用，不能走向量相似度："启动 2 号机器人" 和 "急停 2 号机器人" 的相似度远高于阈值，会重放错误的动作。
+    """
+    return st.session_state.command_cache.get_exact(prompt.strip())
+
+
+def remember_command(prompt, content_text, tool_calls, robot_ids):
+    """
+    只记住自包含的指令 (点名了编号、不含 "它" / "同上" / "所有停止的" 这类说法)：
+    缓存键只有原文，重放时模型看不到当前历史和设备状态，依赖上下文的指令重放会动错机器人。
+    """
+    if is_cacheable_command(prompt, robot_ids):
+        st.session_state.command_cache.put_exact(prompt.strip(), (content_text, tool_calls))
+
+
+def _extract_json(text):
+    """
+    单遍扫描，依次产出每个顶层括号配平的 {...} 片段：按深度计数，跳过字符串里的括号和转义字符。
+    回复里夹带代码块、示例时也不会像 find / rfind 那样切错范围。
+    """
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"' and depth:
+            in_string = True
+        elif c == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
+
+
+def parse_inline_command(content_text):
+    """
+    模型没走 Function Calling、直接输出 JSON 指令时的兜底解析。
+    不管整段是不是以 { 开头、} 结尾都逐个扫描配平的片段，返回第一个带 name 的指令对象：
+    像 '{"a": 1} 然后 {"name": ...}' 这样首尾都是括号的回复，整段解析会失败，扫描才能找到后面的指令。
+    """
+    for fragment in _extract_json(content_text):
+        try:
+            obj = _loose_json(fragment)
+            # 有的模型会把 arguments 再包成一层 JSON 字符串
+            if isinstance(obj, dict) and isinstance(obj.get("arguments"), str):
+                obj["arguments"] = _loose_json(obj["arguments"])
+        except orjson.JSONDecodeError as e:
+            print(f"指令 JSON 解析失败: {e}")
+            continue
+        if isinstance(obj, dict) and "name" in obj:
+            return obj
+    return None
+
+
+STATUS_TTL = 1.0
+
+
+def _status_snapshot():
+    """
+    机器人状态快照：同一版本号在 1 秒内的重跑直接复用，不再每次重跑都模拟波动；
+    指令执行成功后版本号变化，立即失效。
+    记在 session_state 里而不是 st.cache_data：复制的标签页 / 分享的链接会带着同一个 sid，
+    但控制器各自独立，跨会话共享的缓存会让它们读到彼此的状态。
+    """
+    version = st.session_state.controller_version
+    now = time.monotonic()
+    memo = st.session_state.get("status_memo")
+    if memo is None or memo[0] != version or now - memo[1] > STATUS_TTL:
+        memo = (version, now, status_tuple(controller.get_all_status()))
+        st.session_state.status_memo = memo
+    return memo[2]
+
+
+# 状态 -> (徽章样式, 图标)，其余状态按 Running 显示
+CARD_STYLES = {
+    "Stopped": ("status-stopped", "🟡"),
+    "Emergency_Stop": ("status-emergency", "🚨"),
+}
+
+
+def status_tuple(status_dict):
+    """卡片只依赖这几个字段，抽成元组存进状态快照，不保留整份状态字典"""
+    return tuple(
+        (d["id"], d["status"], d["temperature"], d["speed"]) for d in status_dict.values()
+    )
+
+
+def render_cards_html(cards):
+    """
+    5 张卡片拼成一段 flex 布局，一次 st.markdown 发出。
+    不套 st.cache_data：温度每次快照都在波动，缓存几乎命中不了，哈希 + pickle 参数反而比拼 f-string 还贵。
+    """
+    parts = []
+    for r_id, status, temperature, speed in cards:
+        status_color, icon = CARD_STYLES.get(status, ("status-running", "🟢"))
+        temp_color = "#FF5252" if temperature > 70 else "#FAFAFA"
+        parts.append(
+            f"""<div class="robot-card" style="flex:1;">
+<div style="display:flex; justify-content:space-between; margin-bottom:10px;">
+<span style="font-weight:bold;">🤖 #{r_id}</span>
+<span class="badge {status_color}">{icon} {status}</span>
+</div>
+<div style="display:flex; justify-content:space-between;">
+<div><div class="metric-label">TEMP</div><div class="metric-value" style="color:{temp_color}">{temperature}°C</div></div>
+<div><div class="metric-label">SPEED</div><div class="metric-value">{speed}%</div></div>
+</div>
+</div>"""
+        )
+    return f'<div style="display:flex; gap:10px;">{"".join(parts)}</div>'
+
+
 # --- 5. 顶部：AI 指挥官对话区域 (保持原样) ---
 st.markdown("### 🎮 工业 AI 指挥中枢")
 
-status_dict = controller.get_all_status()
-cols = st.columns(len(status_dict))
-for idx, (r_id, data) in enumerate(status_dict.items()):
-    with cols[idx]:
-        status_color = "status-running"
-        icon = "🟢"
-        if data["status"] == "Stopped":
-            status_color = "status-stopped"
-            icon = "🟡"
-        elif data["status"] == "Emergency_Stop":
-            status_color = "status-emergency"
-            icon = "🚨"
-
-        st.markdown(
-            f"""
-        <div class="robot-card">
-            <div style="display:flex; justify-content:space-between; margin-bottom:10px;">
-                <span style="font-weight:bold;">🤖 #{data['id']}</span>
-                <span class="badge {status_color}">{icon} {data['status']}</span>
-            </div>
-            <div style="display:flex; justify-content:space-between;">
-                <div><div class="metric-label">TEMP</div><div class="metric-value" style="color:{'#FF5252' if data['temperature']>70 else '#FAFAFA'}">{data['temperature']}°C</div></div>
-                <div><div class="metric-label">SPEED</div><div class="metric-value">{data['speed']}%</div></div>
-            </div>
-        </div>
-        """,
-            unsafe_allow_html=True,
-        )
+
+# 卡片画在占位符里：指令执行后原地重画，不需要整页 st.rerun()
+cards_slot = st.empty()
+
+
+def draw_robot_cards():
+    cards_slot.markdown(render_cards_html(_status_snapshot()), unsafe_allow_html=True)
+
+
+draw_robot_cards()
 
 st.divider()
 
 # --- 6. 聊天逻辑 (保持原样) ---
-if "cmd_messages" not in st.session_state:
-    st.session_state.cmd_messages = [
-        {
-            "role": "system",
-            "content": """你是一个工业控制程序。
+@st.cache_resource
+def _system_message():
+    return {
+        "role": "system",
+        "content": """你是一个工业控制程序。
             1. 必须优先使用 Function Calling (工具调用)。
             2. 如果无法使用工具，请直接输出 JSON 格式的指令，例如：
                {"name": "startup_system", "arguments": {"robot_id": 1, "target_speed": 80}}
             3. 严禁废话，严禁 Markdown，只输出 JSON。
             """,
-        }
-    ]
+    }
+
+
+if "cmd_messages" not in st.session_state:
+    st.session_state.cmd_messages = [dict(_system_message())] + chat_store.load_last_n(
+        st.session_state.session_id
+    )
+
+
+def remember(message):
+    """
+    追加到会话历史，同时写入 SQLite。
+    助手消息写入时就标记是否是 JSON 指令 (_is_json)，重放历史时不用再逐条扫描内容。
+    """
+    if message["role"] == "assistant":
+        message["_is_json"] = (message.get("content") or "").lstrip().startswith("{")
+    st.session_state.cmd_messages.append(message)
+    chat_store.append(st.session_state.session_id, message)
 
-for msg in st.session_state.cmd_messages:
+
+last_index = len(st.session_state.cmd_messages) - 1
+for i, msg in enumerate(st.session_state.cmd_messages):
     if msg["role"] == "user":
         with st.chat_message("user"):
             st.write(msg["content"])
     elif msg["role"] == "assistant":
         with st.chat_message("assistant"):
             content = str(msg["content"])
-            if "{" in content:
-                st.code(content, language="json")
+            if msg.get("_is_json"):
+                # 只有最新一条走代码高亮，更早的 JSON 指令用纯文本显示，省掉逐条语法高亮
+                if i == last_index:
+                    st.code(content, language="json")
+                else:
+                    st.text(content)
             else:
                 st.write(content)
 
 if prompt := st.chat_input("💬 下达指令..."):
-    st.session_state.cmd_messages.append({"role": "user", "content": prompt})
+    remember({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.write(prompt)
 
     with st.status("🧠 Agent 正在处理...", expanded=True) as status:
         try:
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=st.session_state.cmd_messages,
-                tools=tools,
-                tool_choice="auto",
-            )
-            response_message = response.choices[0].message
-            content_text = response_message.content or ""
-            tool_calls = response_message.tool_calls
+            cache_hit = lookup_command_cache(prompt)
+            if cache_hit is not None:
+                status.write("⚡ 命中指令缓存，跳过模型调用")
+                content_text, cached_calls = cache_hit
+                # 每次重放都换新的 tool_call_id，历史里的 id 不能重复
+                tool_calls = [dict(tc, id=f"call_{uuid.uuid4().hex[:24]}") for tc in cached_calls]
+            else:
+                tool_calls_acc = {}
+                with st.chat_message("assistant"):
+                    streamed = st.write_stream(
+                        stream_reply(window_messages(st.session_state.cmd_messages), tool_calls_acc)
+                    )
+                content_text = streamed if isinstance(streamed, str) else ""
+                tool_calls = [tool_calls_acc[i] for i in sorted(tool_calls_acc)]
 
             executed_any = False
 
             if tool_calls:
-                st.session_state.cmd_messages.append(response_message.model_dump())
-                for tool_call in tool_calls:
-                    func_name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
-                    result = execute_command(func_name, args, status)
-                    st.session_state.cmd_messages.append(
+                # 先解析完参数再写历史：历史里的 tool_calls 必须每一条都有对应的 tool 消息，
+                # 否则之后基于这段历史的请求都会被接口拒绝 (刷新页面从 SQLite 恢复后也一样)
+                parsed_args = [parse_tool_arguments(tc) for tc in tool_calls]
+                remember(
+                    {"role": "assistant", "content": content_text or None, "tool_calls": tool_calls}
+                )
+                try:
+                    results = asyncio.run(run_tool_calls(tool_calls, parsed_args, status))
+                except Exception as e:
+                    results = [{"success": False, "message": f"崩溃: {str(e)}"}] * len(tool_calls)
+                for tool_call, result in zip(tool_calls, results):
+                    remember(
                         {
-                            "tool_call_id": tool_call.id,
+                            "tool_call_id": tool_call["id"],
                             "role": "tool",
-                            "name": func_name,
-                            "content": json.dumps(result, ensure_ascii=False),
+                            "name": tool_call["function"]["name"],
+                            "content": encode_result(result),
                         }
                     )
                 executed_any = True
+                # 只缓存全部执行成功的指令，失败的 (如 ID 不存在) 下次还是交给模型
+                if cache_hit is None and all(
+                    isinstance(r, dict) and r.get("success") for r in results
+                ):
+                    robot_ids = [_robot_id(args) for args in parsed_args]
+                    remember_command(prompt, content_text, tool_calls, robot_ids)
 
-            elif "{" in content_text:
-                try:
-                    start = content_text.find("{")
-                    end = content_text.rfind("}") + 1
-                    json_str = content_text[start:end]
-                    try:
-                        obj = json.loads(json_str)
-                    except Exception:
-                        obj = ast.literal_eval(json_str)
-
-                    if isinstance(obj, dict) and "name" in obj:
-                        func_name = obj["name"]
-                        args = obj.get("arguments", {})
-                        result = execute_command(func_name, args, status)
-                        executed_any = True
-                        st.session_state.cmd_messages.append(
-                            {"role": "assistant", "content": content_text}
-                        )
-                except Exception:
-                    st.session_state.cmd_messages.append(
-                        {"role": "assistant", "content": content_text}
-                    )
+            elif (obj := parse_inline_command(content_text)) is not None:
+                func_name = obj["name"]
+                args = obj.get("arguments", {})
+                result = execute_command(func_name, args, status)
+                executed_any = True
+                remember({"role": "assistant", "content": content_text})
 
             if executed_any:
+                chat_store.save_snapshot(st.session_state.session_id, controller.robots)
                 status.update(label="✅ 指令已送达底层", state="complete", expanded=False)
                 with st.chat_message("assistant"):
-                    st.success("✅ 操作已执行，正在同步状态...")
+                    st.success("✅ 操作执行完毕。")
 
-                st.session_state.cmd_messages.append(
+                remember(
                     {"role": "assistant", "content": "✅ 操作执行完毕。"}
                 )
-                time.sleep(0.5)
-                st.rerun()
+                # 版本号已经变了，只重画顶部卡片
+                draw_robot_cards()
             else:
+                # 回复已经流式渲染过了，这里只记入历史
                 status.update(label="💬 消息", state="complete", expanded=False)
-                with st.chat_message("assistant"):
-                    st.write(content_text)
-                st.session_state.cmd_messages.append(
+                remember(
                     {"role": "assistant", "content": content_text}
                 )
 
@@ -258,69 +581,177 @@ st.divider()
 st.markdown("### 📡 实时数据监控面板")
 toggle_on = st.toggle("启动实时数据流模拟", value=False)
 
-if toggle_on:
-    status_container = st.empty()
-    
-    # 连续刷新 20 次，每次 0.1秒，总共 2秒 刷新一次页面
-    for _ in range(20): 
-        # === 核心算法：基于时间的周期性正弦波 ===
+# === 核心算法：基于时间的周期性正弦波 ===
+# 周期设为 18秒左右 (系数 0.35 => 2*pi/0.35 ≈ 18)
+# 基准线 95度，振幅 15度 => 范围在 [80, 110] 之间
+# 这样就有大概 7-8秒在 100以上，10秒在 100以下
+TREND_OMEGA = 0.35
+TREND_STEPS = 1024   # 一个周期切成 1024 个相位
+JITTER_POOL = 4096   # 预生成的噪声个数
+
+
+@st.cache_resource
+def _monitor_tables():
+    """用 NumPy 一次性算好一个周期的正弦趋势表和噪声池，每帧只查表 (页面脚本每次重跑都会重新执行，所以放进缓存)"""
+    phases = np.linspace(0, 2 * np.pi, TREND_STEPS, endpoint=False)
+    trend_table = (95 + 15 * np.sin(phases)).tolist()
+    # 添加高频噪声 (jitter)，让它看起来像真实传感器的跳动
+    jitter_pool = np.random.default_rng().uniform(-1.5, 1.5, JITTER_POOL).tolist()
+    return trend_table, jitter_pool
+
+
+@st.cache_resource
+def _default_receiver():
+    """报警邮件收件人：进程内只解析一次 secrets (放在页面顶层的话每次重跑都会再查一遍)"""
+    try:
+        return st.secrets["email"]["SENDER_EMAIL"]
+    except Exception:
+        return "admin@example.com"
+
+
+ALERT_COOLDOWN = 300  # 5分钟冷却
+
+
+@st.cache_resource
+def _email_pool():
+    """报警邮件的后台发送线程：SMTP 握手 + 登录要几秒，不能卡住页面脚本"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="alert-mail")
+
+
+def _log_email_result(future):
+    try:
+        print(f"报警邮件: {future.result()}")
+    except Exception as e:
+        print(f"报警邮件发送异常: {e}")
+
+
+def try_start_alert():
+    """冷却检查和更新放在同一把锁里，连续几次重跑都看到已过冷却期时只有一次能触发报警"""
+    with st.session_state.alert_lock:
+        now_ts = time.monotonic()
+        elapsed = now_ts - st.session_state.last_alert_time
+        if elapsed <= ALERT_COOLDOWN:
+            return False, elapsed
+        st.session_state.last_alert_time = now_ts
+        return True, elapsed
+
+
+async def _temperature_producer(temp_queue, stop_event, trend_table, jitter_pool):
+    """后台协程：每 100ms 产生一个温度样本放进队列，和 Streamlit 的重跑节奏解耦 (不能访问 st.*)"""
+    cursor = 0
+    idle_ticks = 0
+    while not stop_event.is_set():
         # 1. 获取当前时间秒数
         t = time.time()
-        
-        # 2. 构造正弦波趋势
-        # 周期设为 18秒左右 (系数 0.35 => 2*pi/0.35 ≈ 18)
-        # 基准线 95度，振幅 15度 => 范围在 [80, 110] 之间
-        # 这样就有大概 7-8秒在 100以上，10秒在 100以下
-        trend = 95 + 15 * math.sin(t * 0.35)
-        
-        # 3. 添加高频噪声 (jitter)，让它看起来像真实传感器的跳动
-        jitter = random.uniform(-1.5, 1.5)
-        
-        # 4. 计算最终温度
-        current_temp = trend + jitter
-        
-        # 渲染界面
-        with status_container.container():
-            col1, col2 = st.columns([1, 3])
-            with col1:
-                if current_temp > 100:
-                    st.metric("1号机组温度", f"{current_temp:.1f} °C", "🔥 高温报警", delta_color="inverse")
-                else:
-                    st.metric("1号机组温度", f"{current_temp:.1f} °C", "✅ 运行正常")
-            with col2:
-                # 进度条显示 (80度-120度范围)
-                # 归一化：(当前-80) / 40
-                progress = (current_temp - 70) / 50
-                st.progress(min(max(progress, 0.0), 1.0))
-                
-                # === 报警检测逻辑 ===
-                if current_temp > 100:
-                    now_ts = time.time()
-                    elapsed = now_ts - st.session_state.last_alert_time
-                    
-                    if elapsed > 300: # 5分钟冷却
-                        # 模拟发送邮件
-                        st.toast(f"🔥 峰值警报！温度达 {current_temp:.1f}°C", icon="🚨")
-                        try:
-                            default_receiver = st.secrets["email"]["SENDER_EMAIL"]
-                        except:
-                            default_receiver = "admin@example.com"
-                            
-                        send_email_action(
-                            to_email=default_receiver,
-                            subject=f"【高温警报】1号机负载过高 ({current_temp:.1f}°C)",
-                            content=f"系统检测到温度周期性波峰。\n当前值：{current_temp:.1f}°C\n请注意散热系统是否正常。"
-                        )
-                        st.session_state.last_alert_time = now_ts
-                        st.error(f"🔥 报警已触发：温度 {current_temp:.1f}°C (邮件已发送)")
-                    else:
-                        remaining = 300 - int(elapsed)
-                        st.warning(f"⚠️ 温度处于高位周期... (报警冷却: {remaining}s)")
-                else:
-                    st.caption("✅ 温度回落，系统散热中...")
 
-        # 极速刷新，保证肉眼看到的丝滑跳动
-        time.sleep(0.1)
+        # 2. 查表得到正弦波趋势
+        phase = (t * TREND_OMEGA / (2 * np.pi)) % 1.0
+        trend = trend_table[int(phase * TREND_STEPS)]
+
+        # 3. 从噪声池里顺序取一个 jitter
+        jitter = jitter_pool[cursor % JITTER_POOL]
+        cursor += 1
+
+        # 4. 计算最终温度；队列满了就挤掉最旧的样本
+        sample = (t, trend + jitter)
+        try:
+            temp_queue.put_nowait(sample)
+            idle_ticks = 0
+        except queue.Full:
+            idle_ticks += 1
+            # 连续 30 秒没人消费 (会话已关闭)，自行退出，避免线程泄漏
+            if idle_ticks > 300:
+                return
+            try:
+                temp_queue.get_nowait()
+            except queue.Empty:
+                pass
+            temp_queue.put_nowait(sample)
+
+        await asyncio.sleep(0.1)
+
+
+def _ensure_producer():
+    """每个会话只启动一个生产者线程"""
+    worker = st.session_state.get("temp_producer")
+    if worker is not None and worker[0].is_alive():
+        return worker
+    temp_queue = queue.Queue(maxsize=128)
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=asyncio.run,
+        args=(_temperature_producer(temp_queue, stop_event, *_monitor_tables()),),
+        daemon=True,
+    )
+    thread.start()
+    st.session_state.temp_producer = (thread, temp_queue, stop_event)
+    return st.session_state.temp_producer
+
+
+def _stop_producer():
+    worker = st.session_state.pop("temp_producer", None)
+    if worker is not None:
+        worker[2].set()
+    st.session_state.pop("monitor_sample", None)
+
+
+# 局部刷新间隔：只重跑下面的监控片段，聊天区和机器人卡片不受影响 (不低于 50ms，否则前端来不及渲染)
+MONITOR_INTERVAL = 0.2
+
 
-    # 循环结束后重载
-    st.rerun()
+@st.fragment(run_every=MONITOR_INTERVAL if toggle_on else None)
+def monitor_panel():
+    _, temp_queue, _ = _ensure_producer()
+
+    # 只要队列里最新的一条，中间积压的样本直接丢掉
+    sample = st.session_state.get("monitor_sample")
+    while True:
+        try:
+            sample = temp_queue.get_nowait()
+        except queue.Empty:
+            break
+    st.session_state.monitor_sample = sample
+
+    if sample is None:
+        st.caption("⏳ 正在连接数据流...")
+        return
+    _, current_temp = sample
+
+    # 渲染界面
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if current_temp > 100:
+            st.metric("1号机组温度", f"{current_temp:.1f} °C", "🔥 高温报警", delta_color="inverse")
+        else:
+            st.metric("1号机组温度", f"{current_temp:.1f} °C", "✅ 运行正常")
+    with col2:
+        # 进度条显示 (80度-120度范围)
+        # 归一化：(当前-80) / 40
+        progress = (current_temp - 70) / 50
+        st.progress(min(max(progress, 0.0), 1.0))
+
+        # === 报警检测逻辑 ===
+        if current_temp > 100:
+            triggered, elapsed = try_start_alert()
+
+            if triggered:
+                # 模拟发送邮件
+                st.toast(f"🔥 峰值警报！温度达 {current_temp:.1f}°C", icon="🚨")
+                _email_pool().submit(
+                    send_email_action,
+                    to_email=_default_receiver(),
+                    subject=f"【高温警报】1号机负载过高 ({current_temp:.1f}°C)",
+                    content=f"系统检测到温度周期性波峰。\n当前值：{current_temp:.1f}°C\n请注意散热系统是否正常。"
+                ).add_done_callback(_log_email_result)
+                st.error(f"🔥 报警已触发：温度 {current_temp:.1f}°C (邮件后台发送中)")
+            else:
+                remaining = ALERT_COOLDOWN - int(elapsed)
+                st.warning(f"⚠️ 温度处于高位周期... (报警冷却: {remaining}s)")
+        else:
+            st.caption("✅ 温度回落，系统散热中...")
+
+
+if toggle_on:
+    monitor_panel()
+else:
+    _stop_producer()
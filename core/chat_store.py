@@ -0,0 +1,107 @@
+# core/chat_store.py
+
+import json
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+# 数据库文件放在运行目录下；Streamlit 重启、浏览器刷新后都能按 session_id 找回对话
+DB_PATH = "chat_history.db"
+
+# 滑动窗口：发给模型 / 恢复会话时只保留最近 N 轮 (一轮 = 一条用户消息 + 其后的助手/工具消息)
+WINDOW_TURNS = 10
+
+
+class ChatStore:
+    """
+    SQLite 持久化的对话历史 + 控制器状态快照。
+    每条消息整体 JSON 序列化后存进 content 列 (工具调用消息带 tool_calls 等额外字段)。
+    """
+
+    def __init__(self, path=DB_PATH):
+        # 进程内共用一个连接，Streamlit 每个会话在不同线程里跑，用锁串行化写入
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    turn INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    ts REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, turn)"
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS snapshots (
+                    session_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    ts REAL NOT NULL
+                )"""
+            )
+
+    # --- 对话历史 ---
+    def append(self, session_id, message):
+        """写入一条消息；用户消息开启新的一轮"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT MAX(turn) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            turn = row[0] or 0
+            if message["role"] == "user":
+                turn += 1
+            self._conn.execute(
+                "INSERT INTO messages (session_id, turn, role, content, ts) VALUES (?, ?, ?, ?, ?)",
+                (session_id, turn, message["role"], json.dumps(message, ensure_ascii=False), time.time()),
+            )
+
+    def load_last_n(self, session_id, n=WINDOW_TURNS):
+        """按写入顺序取回最近 n 轮消息 (不含 system 消息)"""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT content FROM messages
+                   WHERE session_id = ?
+                     AND turn > (SELECT COALESCE(MAX(turn), 0) FROM messages WHERE session_id = ?) - ?
+                   ORDER BY rowid""",
+                (session_id, session_id, n),
+            ).fetchall()
+        return [json.loads(content) for (content,) in rows]
+
+    # --- 控制器快照 ---
+    def save_snapshot(self, session_id, robots):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (session_id, status, ts) VALUES (?, ?, ?)",
+                (session_id, json.dumps(robots, ensure_ascii=False), time.time()),
+            )
+
+    def load_snapshot(self, session_id):
+        """返回 {robot_id: 状态字典}，没有快照时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM snapshots WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        # JSON 的键都是字符串，还原成控制器使用的整数 ID
+        return {int(r_id): data for r_id, data in json.loads(row[0]).items()}
+
+
+def window_messages(messages, n=WINDOW_TURNS):
+    """system 消息 + 最近 n 轮；只在用户消息处截断，不会把 tool_calls 和对应的工具结果拆开"""
+    system = [m for m in messages[:1] if m["role"] == "system"]
+    user_idx = [i for i, m in enumerate(messages) if m["role"] == "user"]
+    if len(user_idx) <= n:
+        return messages
+    return system + messages[user_idx[-n]:]
+
+
+@st.cache_resource
+def get_chat_store() -> ChatStore:
+    return ChatStore()
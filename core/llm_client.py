@@ -12,6 +12,9 @@ ZHIPU_BASE_URL = "https://open.bigmodel.cn/api/paas/v4/"
 
 MODEL_NAME = "glm-4-flash"
 
+# 进程级单例：所有会话、每一轮对话共用同一个客户端 (及其 HTTP 连接池)，
+# handle_chat 里每轮调用 get_client() 只是一次缓存命中，不会重复建连
+
 @st.cache_resource
 
 def get_client() -> OpenAI:
@@ -0,0 +1,126 @@
+# core/pdf_reader.py
+
+import io
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pypdfium2
+
+# 定义最大页数限制 (保护 2G 内存服务器)
+MAX_PAGES = 50
+
+# 进程池只给 pdfplumber 兜底用：pdfminer 是纯 Python (抢 GIL)，线程池没有意义。
+# pypdfium2 主路径每页只要零点几毫秒，50 页串行约 25ms，开 4 个 spawn 进程反而要 250ms 以上，直接在当前进程读
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+# 页数少时进程启动开销比省下的时间还多，直接在当前进程读取
+PARALLEL_MIN_PAGES = 16
+
+
+# === 1. 按页区间读取 (pdfplumber 的区间函数会在子进程里执行，必须是模块级函数才能被 pickle) ===
+def _pdfium_count(file_bytes):
+    pdf = pypdfium2.PdfDocument(file_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _pdfium_range(file_bytes, start, stop):
+    """用 pypdfium2 的整页文本接口提取 (不构建逐字符布局对象)"""
+    pages_text = []
+    pdf = pypdfium2.PdfDocument(file_bytes)
+    try:
+        for i in range(start, stop):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            pages_text.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    return pages_text
+
+
+def _plumber_count(file_bytes):
+    # pdfplumber 会连带导入 pdfminer.six / pillow，只有回退时才需要，延迟导入省掉冷启动开销
+    import pdfplumber
+
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        return len(pdf.pages)
+
+
+def _plumber_range(file_bytes, start, stop):
+    """pdfplumber 兜底方案：速度慢，但对格式异常的 PDF 更宽容"""
+    import pdfplumber
+
+    pages_text = []
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        # 只取一次 pdf.pages，按区间迭代，不在循环里反复按下标访问
+        for page in itertools.islice(pdf.pages, start, stop):
+            # 扫描件 (纯图片页) 没有字符对象，直接跳过，不走文本聚合
+            if not page.chars:
+                pages_text.append("")
+                continue
+            # RAG 入库不需要版面还原：extract_text_simple 只按行聚合字符，跳过 extract_text 的逐词布局聚类
+            pages_text.append(page.extract_text_simple(x_tolerance=3, y_tolerance=3) or "")
+    return pages_text
+
+
+# === 2. 调度 ===
+def _split_ranges(total, parts):
+    """把 [0, total) 切成 parts 段连续区间"""
+    step = -(-total // parts)  # 向上取整
+    return [(start, min(start + step, total)) for start in range(0, total, step)]
+
+
+def _read_serial(read_range, file_bytes, process_pages, on_progress):
+    pages_text = read_range(file_bytes, 0, process_pages)
+    if on_progress and process_pages:
+        on_progress(process_pages, process_pages)
+    return pages_text
+
+
+def _read_parallel(read_range, file_bytes, process_pages, on_progress):
+    workers = min(MAX_WORKERS, process_pages)
+    if process_pages < PARALLEL_MIN_PAGES or workers < 2:
+        return _read_serial(read_range, file_bytes, process_pages, on_progress)
+
+    # 每个进程一段：每次提交都要把整份 file_bytes pickle 给子进程，段数越少内存里的副本越少
+    ranges = _split_ranges(process_pages, workers)
+    results = [None] * len(ranges)
+    done = 0
+    # spawn：Streamlit 进程里有多个线程，fork 不安全
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        futures = {
+            ex.submit(read_range, file_bytes, start, stop): idx
+            for idx, (start, stop) in enumerate(ranges)
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            results[idx] = future.result()
+            done += len(results[idx])
+            if on_progress:
+                on_progress(done, process_pages)
+
+    return [page_text for chunk in results for page_text in chunk]
+
+
+def read_pdf_pages(file_bytes, max_pages=MAX_PAGES, on_progress=None):
+    """
+    提取 PDF 每页文本，优先 pypdfium2 (当前进程串行)，解析失败再回退 pdfplumber (页数多时多进程并行)。
+    返回 (总页数, 每页文本列表)，on_progress(已完成页数, 待处理页数) 用于刷新进度条。
+    """
+    try:
+        total_pages = _pdfium_count(file_bytes)
+        process_pages = min(total_pages, max_pages)
+        return total_pages, _read_serial(_pdfium_range, file_bytes, process_pages, on_progress)
+    except Exception as e:
+        print(f"pypdfium2 解析失败，回退 pdfplumber: {e}")
+
+    total_pages = _plumber_count(file_bytes)
+    process_pages = min(total_pages, max_pages)
+    return total_pages, _read_parallel(_plumber_range, file_bytes, process_pages, on_progress)
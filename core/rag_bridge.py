@@ -1,118 +1,282 @@
 import streamlit as st
 import os
-import zhipuai
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
-# === 1. 关键修复：所有引用都指向新版路径 ===
-# 以前是 langchain.text_splitter，现在是 langchain_text_splitters
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# langchain / chromadb / zhipuai 连带导入几十 MB 的模块 (onnxruntime、numpy 等)，都在函数里首次用到时才导入：
+# app.py 启动时就导入本模块，还没上传文档、没建库之前不用为它们付冷启动的几百毫秒。
+# 新版路径：langchain_text_splitters / langchain_community.vectorstores / langchain_core.embeddings
 
-# 以前是 langchain.vectorstores，现在是 langchain_community.vectorstores
-from langchain_community.vectorstores import Chroma
 
-# 以前是 langchain.docstore.document，现在是 langchain_core.documents
-from langchain_core.documents import Document
+# === 1. 自定义智谱 Embedding 类 (适配 LangChain) ===
+# 向量化走智谱云端 API，服务器本地不跑模型 (2G 内存装不下 torch + 本地模型)；
+# 入库 / 检索的耗时主要是网络往返，优化方向是批量请求和连接复用，而不是本地推理加速。
+# 注意：换 Embedding 模型会改变向量维度 (embedding-2 为 1024 维)，已有的 chroma_db 需要重建。
+EMBED_MODEL = "embedding-2"
+EMBED_DIM = 1024
+# embedding 接口支持列表输入，单次请求最多 64 条
+EMBED_BATCH_SIZE = 64
+# 并发请求数：等待网络时线程会释放 GIL；再多容易撞上智谱的并发限流
+EMBED_WORKERS = 4
+EMBED_MAX_RETRIES = 3
+# 这些状态码是暂时性的，值得原样重试；其余错误 (400 除外) 直接抛出
+EMBED_RETRY_STATUS = {429, 500, 502, 503, 504}
 
-# 以前是 langchain.embeddings.base，现在是 langchain_core.embeddings
-from langchain_core.embeddings import Embeddings
 
+@st.cache_resource
+def _embed_pool():
+    """进程内共用一个线程池，每次入库不再新建线程"""
+    return ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
 
-# === 2. 自定义智谱 Embedding 类 (适配 LangChain) ===
-class ZhipuEmbedding(Embeddings):
+
+
+@st.cache_resource
+def _zhipu_client(api_key):
+    """
+    进程内共用一个 zhipuai 客户端和 httpx 连接池：线程池里的并发批次复用已建立的 TLS 连接，
+    不再每个实例各自握手。连接数按并发批次数留余量。
+    """
+    import httpx
+    import zhipuai
+
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=EMBED_WORKERS * 2,
+            max_keepalive_connections=EMBED_WORKERS,
+        ),
+    )
+    return zhipuai.ZhipuAI(api_key=api_key, http_client=http_client)
+
+
+class _ZhipuEmbeddingImpl:
+    # LangChain Embeddings 接口的具体实现 (embed_documents / embed_query)；
+    # 真正继承 Embeddings 的子类在 _embedding_class 里首次用到时才定义，模块导入时不加载 langchain_core
     def __init__(self):
         # 从 secrets 获取 Key
         try:
             api_key = st.secrets["general"]["ZHIPU_API_KEY"]
-            self.client = zhipuai.ZhipuAI(api_key=api_key)
+            self.client = _zhipu_client(api_key)
         except Exception:
             st.error("⚠️ 未找到智谱 API Key，请检查 secrets.toml")
             self.client = None
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """批量向量化文档"""
-        if not self.client: return []
-        embeddings = []
-        for text in texts:
+        """LangChain 接口：有片段向量化失败就整体报错，不会把占位向量交给向量库"""
+        embeddings = self.embed_documents_or_none(texts)
+        failed = sum(e is None for e in embeddings)
+        if failed:
+            raise ValueError(f"{failed} 个片段无法向量化")
+        return embeddings
+
+    def embed_documents_or_none(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化文档：每次请求发送一批文本，多批之间用线程池并发，重叠网络往返。
+        被接口拒绝的单个片段对应位置返回 None，由调用方决定丢弃；其他错误直接抛出。
+        """
+        if not self.client: return [None] * len(texts)
+        starts = range(0, len(texts), EMBED_BATCH_SIZE)
+        embeddings = [None] * len(texts)
+        if len(starts) <= 1:
+            embeddings[:] = self._embed_batch(texts)
+            return embeddings
+
+        futures = {
+            _embed_pool().submit(self._embed_batch, texts[start:start + EMBED_BATCH_SIZE]): start
+            for start in starts
+        }
+        try:
+            for future in as_completed(futures):
+                start = futures[future]
+                embeddings[start:start + EMBED_BATCH_SIZE] = future.result()
+        except Exception:
+            # 一批抛错 (鉴权 / 额度 / 网络) 时其余批次大概率也会失败，还没开始的不再发出
+            for future in futures:
+                future.cancel()
+            raise
+        return embeddings
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """
+        限流 (429) 和服务端错误 (5xx) 先指数退避重试同一批；
+        只有请求本身被拒 (400，通常是某个片段内容有问题) 才对半拆开，定位到坏片段后它的位置返回 None。
+        鉴权、额度、网络这类和输入无关的错误拆开也没用，直接抛出。(线程池里执行，不能调用 st.*)
+        """
+        for attempt in range(EMBED_MAX_RETRIES + 1):
             try:
                 response = self.client.embeddings.create(
-                    model="embedding-2",
-                    input=text
+                    model=EMBED_MODEL,
+                    input=batch
                 )
-                embeddings.append(response.data[0].embedding)
+                return [item.embedding for item in response.data]
             except Exception as e:
-                print(f"Embedding error: {e}")
-                embeddings.append([0.0]*1024) # 错误兜底
-        return embeddings
+                status_code = getattr(e, "status_code", None)
+                if status_code == 400:
+                    error = e
+                    break
+                if status_code not in EMBED_RETRY_STATUS or attempt == EMBED_MAX_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+        if len(batch) == 1:
+            print(f"Embedding error: {error}")
+            return [None]
+        mid = len(batch) // 2
+        return self._embed_batch(batch[:mid]) + self._embed_batch(batch[mid:])
 
     def embed_query(self, text: str) -> List[float]:
         """向量化单个问题"""
         if not self.client: return []
         try:
             response = self.client.embeddings.create(
-                model="embedding-2",
+                model=EMBED_MODEL,
                 input=text
             )
             return response.data[0].embedding
         except Exception as e:
             print(f"Embedding query error: {e}")
-            return [0.0]*1024
+            return [0.0] * EMBED_DIM
+
+@st.cache_resource
+def _embedding_class():
+    """延迟导入 langchain_core，定义真正继承 Embeddings 的子类 (aembed_documents / aembed_query 由基类提供)"""
+    from langchain_core.embeddings import Embeddings
+
+    class ZhipuEmbedding(_ZhipuEmbeddingImpl, Embeddings):
+        pass
 
-# === 3. 核心功能函数 ===
+    return ZhipuEmbedding
+
+
+# 进程级单例：入库和每次检索共用同一个 Embedding 实例 (及其 HTTP 连接池)，不再重复读 secrets、新建客户端；
+# 没读到 Key 时不缓存，配置好之后下次调用就能生效
+@st.cache_resource(validate=lambda embedding: embedding.client is not None)
+def get_embedding():
+    return _embedding_class()()
+
+
+# === 2. 核心功能函数 ===
 
 # 定义持久化存储路径
 PERSIST_DIRECTORY = "./chroma_db"
 
-def build_vector_store(text_content):
-    """
-    将长文本切片并存入 ChromaDB
-    """
-    if not text_content:
-        return "⚠️ 内容为空"
-    
-    # 1. 切分文本
-    text_splitter = RecursiveCharacterTextSplitter(
+
+@st.cache_resource
+def _open_db(persist_directory):
+    """Chroma 句柄按目录缓存，检索时不再每个问题重新打开集合"""
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=get_embedding()
+    )
+
+# 切分器是无状态的，进程内建一次，之后每次入库直接复用
+@st.cache_resource
+def _splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
         chunk_size=500,  # 每块500字
         chunk_overlap=50 # 重叠50字，防止语义断裂
     )
-    # 将字符串转为 Document 对象
-    docs = [Document(page_content=x) for x in text_splitter.split_text(text_content)]
+
+def split_text(text_content):
+    """
+    切分长文本，返回片段列表
+    """
+    return _splitter().split_text(text_content)
+
+def build_vector_store(chunks, doc_hash=None):
+    """
+    将文本片段列表批量向量化并存入 ChromaDB (传入整段字符串时先自动切分)
+    传入 doc_hash 时片段 ID 固定为 "{doc_hash}:{序号}"：同一份文档再次入库只补缺失的片段，不会重复写入
+    向量化失败的片段不入库 (不写占位向量)，结果提示里说明跳过了几个，重新上传同一文档时会再补一次
+    """
+    # 1. 切分文本
+    if isinstance(chunks, str):
+        chunks = split_text(chunks)
+    if not chunks:
+        return "⚠️ 内容为空"
+
+    texts = list(chunks)
+    ids = ([f"{doc_hash}:{i}" for i in range(len(texts))] if doc_hash
+           else [uuid.uuid4().hex for _ in texts])
     
     # 2. 存入向量数据库
     try:
-        # 使用我们自定义的智谱 Embedding
-        embedding_function = ZhipuEmbedding()
-        
-        # 创建并持久化
-        db = Chroma.from_documents(
-            documents=docs,
-            embedding=embedding_function,
-            persist_directory=PERSIST_DIRECTORY
+        # 写入缓存的 Chroma 句柄 (使用我们自定义的智谱 Embedding)，随后的检索直接能查到
+        db = _open_db(PERSIST_DIRECTORY)
+        if doc_hash:
+            # 已经入库的片段跳过 (也省掉它们的 Embedding 请求)；
+            # 旧版本兜底写入的全零向量不算已入库，这次重新向量化覆盖掉
+            existing = db.get(ids=ids, include=["embeddings"])
+            done = {
+                doc_id for doc_id, emb in zip(existing["ids"], existing["embeddings"])
+                if any(emb)
+            }
+            missing = [i for i, doc_id in enumerate(ids) if doc_id not in done]
+            if not missing:
+                return f"✅ 知识库中已有该文档，共 {len(texts)} 个片段。"
+            texts = [texts[i] for i in missing]
+            ids = [ids[i] for i in missing]
+
+        # 先自己算好向量，失败的片段连同 ID 一起去掉，只把成功的交给 Chroma
+        embeddings = get_embedding().embed_documents_or_none(texts)
+        ok = [i for i, emb in enumerate(embeddings) if emb is not None]
+        skipped = len(texts) - len(ok)
+        if not ok:
+            return f"❌ 构建失败: {skipped} 个片段全部向量化失败"
+        # add_documents 会把整批再交给 embed_documents 重算一遍，这里把算好的向量直接写进底层集合
+        db._collection.upsert(
+            ids=[ids[i] for i in ok],
+            embeddings=[embeddings[i] for i in ok],
+            documents=[texts[i] for i in ok],
         )
         # 强制保存 (新版 Chroma 自动保存，但为了保险)
         # db.persist() 
-        return f"✅ 知识库构建成功！共存入 {len(docs)} 个片段。"
+        if skipped:
+            # 不以 ✅ 开头：_cached_build 不会缓存这个结果，重新上传时还会补齐跳过的片段
+            return f"⚠️ 知识库部分构建：存入 {len(ok)} 个片段，{skipped} 个片段向量化失败已跳过。"
+        return f"✅ 知识库构建成功！共存入 {len(ok)} 个片段。"
     except Exception as e:
         return f"❌ 构建失败: {str(e)}"
 
-def query_vector_store(question, k=3):
+def query_vector_store(question, k=3, cache=None):
     """
     在数据库中搜索相关内容
+    传入 cache (SemanticCache) 时，重复 / 语义相近的问题直接返回缓存结果，不再检索向量库
     """
     if not os.path.exists(PERSIST_DIRECTORY):
         return "" # 还没建库，返回空
-        
+
+    # 1. 原文完全一致 (例如快捷按钮)，连 Embedding 都不用算
+    cache_key = (question, k)
+    if cache is not None:
+        hit = cache.get_exact(cache_key)
+        if hit is not None:
+            return hit[1]
+
     try:
-        embedding_function = ZhipuEmbedding()
-        db = Chroma(
-            persist_directory=PERSIST_DIRECTORY, 
-            embedding_function=embedding_function
-        )
-        
+        db = _open_db(PERSIST_DIRECTORY)
+
+        # 2. 问题向量只算一次：既用来查语义缓存，也直接用于向量检索
+        query_embedding = get_embedding().embed_query(question)
+        if cache is not None:
+            hit = cache.get_similar(query_embedding)
+            if hit is not None and hit[0] == k:
+                cache.put_exact(cache_key, hit)
+                return hit[1]
+
         # 搜索最相似的 k 个片段
-        docs = db.similarity_search(question, k=k)
+        docs = db.similarity_search_by_vector(query_embedding, k=k)
         
         # 合并结果
         context = "\n\n".join([doc.page_content for doc in docs])
+        if cache is not None:
+            cache.put(cache_key, query_embedding, (k, context))
         return context
     except Exception as e:
         print(f"搜索失败: {e}")
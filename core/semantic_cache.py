@@ -0,0 +1,125 @@
+# core/semantic_cache.py
+
+import re
+from collections import OrderedDict, defaultdict, deque
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    两级查询缓存：
+    1. 原文精确匹配 (LRU)，快捷按钮这类一字不差的重复提问直接命中；
+    2. 向量余弦相似度匹配，措辞略有不同的同义问题也能复用结果。
+    相似度检索用随机投影 LSH 分桶 + 汉明距离 1 的多探针，环形缓冲区再大也只比对少数候选。
+    缓存的向量按 int8 (每条一个缩放系数) 存储，1024 维向量从 4KB 降到 1KB，余弦误差在 1e-2 以内。
+    """
+
+    def __init__(self, threshold=0.95, capacity=128, exact_size=256, n_bits=6, seed=0):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.exact_size = exact_size
+        self.n_bits = n_bits
+        self._seed = seed
+        self._planes = None  # 首次写入时按向量维度生成
+
+        self._exact = OrderedDict()       # key -> value
+        self._ring = deque()              # 按写入顺序记录 entry_id，满了淘汰最旧的
+        self._entries = {}                # entry_id -> (int8 向量, 缩放系数, 桶号, value)
+        self._buckets = defaultdict(set)  # 桶号 -> {entry_id}
+        self._next_id = 0
+
+    # --- 精确匹配 ---
+    def get_exact(self, key):
+        if key not in self._exact:
+            return None
+        self._exact.move_to_end(key)
+        return self._exact[key]
+
+    def put_exact(self, key, value):
+        self._exact[key] = value
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.exact_size:
+            self._exact.popitem(last=False)
+
+    # --- 相似度匹配 ---
+    def _normalize(self, embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if vec.ndim != 1 or norm == 0:
+            return None  # 空向量 / 兜底的全零向量不参与缓存
+        return vec / norm
+
+    @staticmethod
+    def _quantize(unit_vec):
+        """对称 int8 量化：vec ≈ q * scale"""
+        scale = float(np.abs(unit_vec).max()) / 127
+        return np.round(unit_vec / scale).astype(np.int8), scale
+
+    def _bucket(self, unit_vec):
+        if self._planes is None:
+            rng = np.random.default_rng(self._seed)
+            self._planes = rng.standard_normal((self.n_bits, unit_vec.shape[0])).astype(np.float32)
+        bits = (self._planes @ unit_vec) > 0
+        return int(bits @ (1 << np.arange(self.n_bits)))
+
+    def get_similar(self, embedding):
+        unit_vec = self._normalize(embedding)
+        if unit_vec is None or self._planes is None or self._planes.shape[1] != unit_vec.shape[0]:
+            return None
+
+        bucket = self._bucket(unit_vec)
+        probes = [bucket] + [bucket ^ (1 << b) for b in range(self.n_bits)]
+        best_score, best_value = self.threshold, None
+        for probe in probes:
+            for entry_id in self._buckets.get(probe, ()):
+                q_vec, scale, _, value = self._entries[entry_id]
+                score = float(q_vec.astype(np.float32) @ unit_vec) * scale
+                if score >= best_score:
+                    best_score, best_value = score, value
+        return best_value
+
+    def put(self, key, embedding, value):
+        """写入两级缓存"""
+        self.put_exact(key, value)
+
+        unit_vec = self._normalize(embedding)
+        if unit_vec is None:
+            return
+        if self._planes is not None and self._planes.shape[1] != unit_vec.shape[0]:
+            return
+
+        bucket = self._bucket(unit_vec)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (*self._quantize(unit_vec), bucket, value)
+        self._buckets[bucket].add(entry_id)
+        self._ring.append(entry_id)
+
+        if len(self._ring) > self.capacity:
+            old_id = self._ring.popleft()
+            _, _, old_bucket, _ = self._entries.pop(old_id)
+            self._buckets[old_bucket].discard(old_id)
+            if not self._buckets[old_bucket]:
+                del self._buckets[old_bucket]
+
+
+# 原文里点名机器人编号的写法："2号" / "#2" / "机器人2" / "robot 2"
+_NAMED_ID = re.compile(r"(\d+)\s*号|#\s*(\d+)|机器人\s*(\d+)|robot\s*(\d+)", re.IGNORECASE)
+# 指代上文或依赖当前状态的说法：同一句话放到不同的对话 / 设备状态下，指向的机器人和动作都可能不同
+_CONTEXT_WORDS = re.compile(
+    r"它|他|她|这|那|同上|上一|上次|刚才|之前|再|继续|恢复|所有|全部|其他|其余|剩下|一样|相同|的机器人"
+    r"|\b(?:it|them|this|that|same|all|again|previous|last|other|rest)\b",
+    re.IGNORECASE,
+)
+
+
+def is_cacheable_command(prompt, robot_ids):
+    """
+    指令缓存只收"自包含"的指令，命中时原样重放 tool_calls，模型看不到当前的对话历史和设备状态：
+    原文必须点名具体编号、不含指代 / 状态相关的说法，且实际操作的机器人 (robot_ids) 正好是点名的这几台。
+    """
+    if not robot_ids or None in robot_ids or _CONTEXT_WORDS.search(prompt):
+        return False
+    named = {int(next(g for g in m.groups() if g)) for m in _NAMED_ID.finditer(prompt)}
+    return bool(named) and named == set(robot_ids)
@@ -0,0 +1,254 @@
+# core/sensor_sim.py
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import streamlit as st
+
+# 初始化机器人配置
+ROBOTS = ['Robot_A01', 'Robot_B02', 'Robot_C03', 'Robot_D04', 'Robot_E05']
+
+# 环形缓冲区：每台机器人保留最近 WINDOW 个采样点 (原来 DataFrame 上限 2500 行 = 5 台 × 500)
+WINDOW = 500
+HISTORY = 100   # 初始化时预填充的历史点数
+TICK = np.timedelta64(2, 's')   # 采样间隔 2 秒
+# 状态在缓冲区里存成 int8 编码，渲染时才查表换成文字
+RUNNING, WARNING, ERROR = 0, 1, 2
+STATUS_NAMES = ('Running', 'Warning', 'Error')
+
+# 预警日志只保留最近这么多条
+ALERT_LOG = 10
+
+# 后台生产者连续这么久没人读 (会话已关闭) 就自行退出
+PRODUCER_IDLE_TIMEOUT = 30
+
+RNG_POOL = 1024   # 每次批量预生成的随机数个数 (float32 共 4KB，放得进 L1)
+
+def _draw(buf, kind, n):
+    """从预生成的随机数池里切出 n 个，池用完再整批补充；省掉每个 tick 多次调用 np.random 的固定开销"""
+    pool = buf[kind]
+    if pool['idx'] + n > RNG_POOL:
+        rng = buf['rng']
+        pool['values'] = (rng.standard_normal(RNG_POOL, dtype=np.float32) if kind == 'normals'
+                          else rng.random(RNG_POOL, dtype=np.float32))
+        pool['idx'] = 0
+    out = pool['values'][pool['idx']:pool['idx'] + n]
+    pool['idx'] += n
+    return out
+
+def normals(buf, n):
+    return _draw(buf, 'normals', n)
+
+def uniforms(buf, n):
+    return _draw(buf, 'uniforms', n)
+
+def init_buffer():
+    """预分配固定大小的数组 (SoA)，之后每个 tick 只写一列，不再 concat / 截断整张表"""
+    n = len(ROBOTS)
+    buf = {
+        'ts': np.empty(WINDOW, dtype='datetime64[s]'),
+        # 读数只显示 1~2 位小数，float32 足够，缓冲区读写和发给 Plotly 的数据量都减半
+        'temp': np.zeros((n, WINDOW), dtype=np.float32),
+        'vib': np.zeros((n, WINDOW), dtype=np.float32),
+        'load': np.zeros((n, WINDOW), dtype=np.float32),
+        'status': np.zeros((n, WINDOW), dtype=np.int8),
+        'head': HISTORY - 1,   # 最新一列的下标
+        'count': HISTORY,      # 已写入的列数
+        # PCG64 比 np.random 的旧版全局 RandomState 快；池子初始为空，第一次取数时填充
+        'rng': np.random.default_rng(),
+        'normals': {'values': None, 'idx': RNG_POOL},
+        'uniforms': {'values': None, 'idx': RNG_POOL},
+        # 后台线程里没有 Streamlit 脚本上下文，单步内核在这里 (脚本线程) 先取好
+        'kernel': _step_kernel(),
+        'lock': threading.Lock(),     # 生产者线程写 / 页面读 互斥
+        'interval': 3.0,              # 生产者推进一步的间隔 (秒)
+        'last_read': time.monotonic(),
+        # 非 Running 的采样在写入时顺手记下来 (旧 → 新)，页面不用每次扫描整个缓冲区找预警
+        'alerts': deque(maxlen=ALERT_LOG),
+    }
+    rng = buf['rng']
+
+    # 保持之前的逻辑：前3台状态好，后2台稍差
+    good = np.arange(n) < 3
+    base_temp = np.where(good, rng.uniform(45, 55, n), rng.uniform(65, 75, n))
+    base_vib = np.where(good, rng.uniform(0.2, 0.4, n), rng.uniform(0.5, 1.5, n))
+    base_load = rng.uniform(5, 8, n)
+
+    i = np.arange(HISTORY)
+    now = np.datetime64(datetime.now(), 's')
+    temp = base_temp[:, None] + rng.normal(0, 1.0, (n, HISTORY))
+    vib = base_vib[:, None] + rng.normal(0, 0.1, (n, HISTORY))
+    load = base_load[:, None] + rng.normal(0, 0.2, (n, HISTORY)) + np.sin(i / 10) * 2
+
+    buf['ts'][:HISTORY] = now - (HISTORY - i) * TICK
+    buf['temp'][:, :HISTORY] = temp
+    buf['vib'][:, :HISTORY] = np.maximum(0, vib)
+    buf['load'][:, :HISTORY] = np.maximum(0, load)
+    buf['status'][:, :HISTORY] = status_of(temp, vib)
+    cols, robots = np.nonzero((buf['status'][:, :HISTORY] != RUNNING).T)
+    for c, r in zip(cols[-ALERT_LOG:], robots[-ALERT_LOG:]):
+        _record_alert(buf, c, r)
+    return buf
+
+def _record_alert(buf, col, r):
+    buf['alerts'].append((buf['ts'][col], r, buf['status'][r, col], buf['temp'][r, col], buf['vib'][r, col]))
+
+def _prune_alerts(buf):
+    """丢掉所在列已被环形缓冲区覆盖的预警：日志和趋势图一样，只反映缓冲区里还在的采样"""
+    oldest = buf['ts'][(buf['head'] - buf['count'] + 1) % WINDOW]
+    alerts = buf['alerts']
+    while alerts and alerts[0][0] < oldest:
+        alerts.popleft()
+
+def status_of(temp, vib):
+    """按温度 / 振动阈值批量计算状态编码 (对 5 台机器人一次算完)"""
+    return np.select(
+        [(temp > 80) | (vib > 5), (temp > 70) | (vib > 3)],
+        [ERROR, WARNING],
+        RUNNING
+    ).astype(np.int8)
+
+def _step_numpy(temp, vib, noise_t, u_spike, u_size, noise_v, out_temp, out_vib, out_status):
+    """单步更新 (NumPy 向量化版本)：结果写进 out_temp / out_vib / out_status"""
+    # 保持之前的自愈逻辑
+    change = noise_t * 0.4
+    change -= np.select([temp > 82, temp > 72], [1.2, 0.6], 0.0)
+    change += np.where(temp < 40, 0.5, 0.0)
+    out_temp[:] = temp + change
+
+    spike = u_spike < 0.01
+    new_vib = np.where(
+        vib > 4, vib * 0.8,
+        np.where(spike,
+                 vib + 2 + u_size,
+                 vib * 0.95 + 0.2 + noise_v * 0.05)
+    )
+    out_vib[:] = np.maximum(0, new_vib)
+    out_status[:] = status_of(out_temp, out_vib)
+
+def _step_loop(temp, vib, noise_t, u_spike, u_size, noise_v, out_temp, out_vib, out_status):
+    """同样的单步更新写成逐台循环，交给 numba 编译；长度只有 5，一个编译好的循环比 NumPy 逐个算子派发快得多"""
+    for i in range(temp.shape[0]):
+        t = temp[i] + noise_t[i] * 0.4
+        if temp[i] > 82:
+            t -= 1.2
+        elif temp[i] > 72:
+            t -= 0.6
+        if temp[i] < 40:
+            t += 0.5
+        out_temp[i] = t
+
+        v = vib[i]
+        if v > 4:
+            v = v * 0.8
+        elif u_spike[i] < 0.01:
+            v = v + 2 + u_size[i]
+        else:
+            v = v * 0.95 + 0.2 + noise_v[i] * 0.05
+        v = max(0.0, v)
+        out_vib[i] = v
+
+        # 阈值按写进缓冲区的 float32 读数判断 (和 NumPy 版本、页面显示的数值一致)，不用循环里的 float64 中间值
+        t = out_temp[i]
+        v = out_vib[i]
+        if t > 80 or v > 5:
+            out_status[i] = ERROR
+        elif t > 70 or v > 3:
+            out_status[i] = WARNING
+        else:
+            out_status[i] = RUNNING
+
+@st.cache_resource
+def _step_kernel():
+    """装了 numba 就返回编译并预热过的循环版本，否则用 NumPy 版本；缓存起来整个进程只编译一次"""
+    try:
+        from numba import njit  # 可选依赖
+    except ImportError:
+        return _step_numpy
+
+    kernel = njit(_step_loop)
+    # 预热用的参数必须和实际 tick 的类型签名一致，否则第一次真实调用还会再编译一遍：
+    # 读数 / 输出是 (n, WINDOW) 缓冲区的列视图 (非连续，numba 布局 'A')，随机数是池子里的连续切片
+    n = len(ROBOTS)
+    cols = np.zeros((n, 2), dtype=np.float32)
+    status_cols = np.zeros((n, 2), dtype=np.int8)
+    noise = np.zeros(n, dtype=np.float32)
+    kernel(cols[:, 0], cols[:, 1], noise, noise, noise, noise,
+           cols[:, 1], cols[:, 0], status_cols[:, 0])
+    return kernel
+
+def generate_next_step(buf):
+    """生成下一秒的实时数据并写入环形缓冲区 (5 台机器人一次算完)"""
+    head = buf['head']
+    new_timestamp = buf['ts'][head] + TICK
+    n = len(ROBOTS)
+    
+    # 最新读数就是 head 那一列，不需要排序 / 分组
+    current_temp = buf['temp'][:, head]
+    current_vib = buf['vib'][:, head]
+    
+    # O(1) 前移写指针，覆盖最旧的一列；新读数直接写进这一列
+    head = (head + 1) % WINDOW
+    new_temp = buf['temp'][:, head]
+    new_vib = buf['vib'][:, head]
+    buf['kernel'](current_temp, current_vib,
+                   normals(buf, n), uniforms(buf, n), uniforms(buf, n), normals(buf, n),
+                   new_temp, new_vib, buf['status'][:, head])
+    
+    seconds = new_timestamp.astype('int64')
+    new_load = 6 + 3 * np.sin(seconds / 20) + normals(buf, n) * 0.1
+    
+    buf['ts'][head] = new_timestamp
+    buf['load'][:, head] = np.maximum(0, new_load)
+    buf['head'] = head
+    buf['count'] = min(buf['count'] + 1, WINDOW)
+    _prune_alerts(buf)
+    for r in np.flatnonzero(buf['status'][:, head] != RUNNING):
+        _record_alert(buf, head, r)
+
+def ordered(buf, key, last=None):
+    """按时间顺序取出最近 last 个采样 (默认全部已写入的)"""
+    k = buf['count'] if last is None else min(last, buf['count'])
+    idx = (buf['head'] - k + 1 + np.arange(k)) % WINDOW
+    return buf[key][..., idx]
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的下标；首尾点固定保留，峰值不会被抹平"""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = x.astype('int64').astype(np.float64)
+    y = y.astype(np.float64)
+    # 中间 n - 2 个点均分成 n_out - 2 个桶，每个桶挑一个点
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = hi, (edges[b + 2] if b + 2 < len(edges) else n)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # 和上一个选中点、下一个桶均值点组成的三角形面积最大的那个点
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[b + 1] = a
+    return out
+
+def snapshot(buf):
+    """加锁取一份按时间排好序的副本 (渲染期间生产者可以继续写)，顺便刷新心跳"""
+    with buf['lock']:
+        buf['last_read'] = time.monotonic()
+        snap = {key: ordered(buf, key) for key in ('ts', 'temp', 'vib', 'load', 'status')}
+        snap['alerts'] = list(buf['alerts'])
+        return snap
+
+def run_producer(buf, stop_event):
+    """后台线程：每隔 buf['interval'] 秒推进一步模拟，和页面渲染节奏解耦 (不能访问 st.*)"""
+    while not stop_event.wait(buf['interval']):
+        if time.monotonic() - buf['last_read'] > PRODUCER_IDLE_TIMEOUT:
+            return
+        with buf['lock']:
+            generate_next_step(buf)
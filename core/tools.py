@@ -1,11 +1,67 @@
 import smtplib
-import json
+import threading
+from functools import lru_cache
+import orjson
 import streamlit as st
 from email.mime.text import MIMEText
 from email.header import Header
 from email.utils import formataddr  # <--- 引入这个标准工具
 
 # === 1. 定义工具函数 ===
+# 复用同一个已登录的 SMTP_SSL 连接，报警邮件不再每封都做一次 TLS 握手 + 登录。
+# 发送在后台线程里执行 (没有 Streamlit 脚本上下文)，所以用模块级变量 + 锁保存连接，而不是 st.cache_resource。
+_smtp_lock = threading.Lock()
+_smtp_conn = None
+
+
+def _drop_smtp():
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.close()
+        except Exception:
+            pass
+    _smtp_conn = None
+
+
+def _get_smtp(smtp_server, smtp_port, sender, password):
+    """NOOP 探活，连接被服务器断开时才重新建立 (调用方需持有 _smtp_lock)"""
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+        _drop_smtp()
+
+    server = smtplib.SMTP_SSL(smtp_server, smtp_port)
+    try:
+        server.login(sender, password)
+    except Exception:
+        # 登录失败 (如授权码错误) 时关掉刚建的连接，否则每次报警都漏一个 socket
+        server.close()
+        raise
+    _smtp_conn = server
+    return server
+
+
+# 发件人 / 收件人头部只和地址有关，按地址缓存编码结果
+@lru_cache(maxsize=64)
+def _from_header(sender):
+    return formataddr(("工业智脑中控", sender))
+
+
+@lru_cache(maxsize=64)
+def _to_header(to_email):
+    return formataddr(("管理员", to_email))
+
+
+def _email_result(status, msg):
+    """返回值结构固定，套模板拼接，只对 msg 做 JSON 转义"""
+    return f'{{"status":"{status}","msg":{orjson.dumps(msg).decode()}}}'
+
+
 def send_email_action(to_email: str, subject: str, content: str):
     """
     发送邮件的实际执行函数 (QQ邮箱 RFC标准版)
@@ -24,27 +80,27 @@ def send_email_action(to_email: str, subject: str, content: str):
         # === 核心修复：使用 formataddr 生成符合 RFC 标准的头部 ===
         # 这样生成的格式是： =?utf-8?b?xxx?= <sender@qq.com>
         # QQ 邮箱绝对挑不出毛病
-        message['From'] = formataddr(("工业智脑中控", sender))
-        message['To'] = formataddr(("管理员", to_email))
-        message['Subject'] = Header(subject, 'utf-8')
+        message['From'] = _from_header(sender)
+        message['To'] = _to_header(to_email)
+        # 纯 ASCII 标题不需要 RFC 2047 编码
+        message['Subject'] = subject if subject.isascii() else Header(subject, 'utf-8')
 
-        # 发送
-        server = smtplib.SMTP_SSL(smtp_server, smtp_port)
-        server.login(sender, password)
-        server.sendmail(sender, [to_email], message.as_string())
-        
-        # 优雅退出
-        try:
-            server.quit()
-        except Exception:
-            pass
+        # 发送 (探活和发送之间连接仍可能被断开，重连后再试一次)
+        with _smtp_lock:
+            try:
+                server = _get_smtp(smtp_server, smtp_port, sender, password)
+                server.sendmail(sender, [to_email], message.as_string())
+            except smtplib.SMTPServerDisconnected:
+                _drop_smtp()
+                server = _get_smtp(smtp_server, smtp_port, sender, password)
+                server.sendmail(sender, [to_email], message.as_string())
         
-        return json.dumps({"status": "success", "msg": f"已成功发送邮件至 {to_email}"})
+        return _email_result("success", f"已成功发送邮件至 {to_email}")
         
     except Exception as e:
         # 打印错误到终端方便调试，同时返回给前端
         print(f"Email Error: {e}")
-        return json.dumps({"status": "error", "msg": f"邮件发送失败: {str(e)}"})
+        return _email_result("error", f"邮件发送失败: {str(e)}")
 
 # === 2. 定义给 GLM-4 看的说明书 (JSON Schema) ===
 GLM_TOOLS = [
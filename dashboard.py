@@ -1,10 +1,14 @@
 import streamlit as st
-import pandas as pd
+import streamlit.components.v1 as components
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import time
-import numpy as np
-from datetime import datetime, timedelta
+import plotly.io as pio
+import threading
+
+from core.sensor_sim import (ROBOTS, STATUS_NAMES, ERROR, WINDOW, init_buffer, lttb_indices,
+                             run_producer, snapshot)
+
+# st.plotly_chart 走 plotly.io.to_json：换成 orjson 引擎，ndarray 直接序列化，不先转成 Python 列表
+pio.json.config.default_engine = 'orjson'
 
 # ==================== 页面配置 ====================
 st.set_page_config(
@@ -15,94 +19,63 @@ st.set_page_config(
 
 # ==================== 1. 核心：实时数据模拟引擎 ====================
 
-# 初始化机器人配置
-ROBOTS = ['Robot_A01', 'Robot_B02', 'Robot_C03', 'Robot_D04', 'Robot_E05']
-
-def init_simulation_data():
-    """初始化历史数据"""
-    now = datetime.now()
-    data = []
-    
-    for idx, robot in enumerate(ROBOTS):
-        # 保持之前的逻辑：前3台状态好，后2台稍差
-        if idx < 3:
-            base_temp = np.random.uniform(45, 55)
-            base_vib = np.random.uniform(0.2, 0.4)
-        else:
-            base_temp = np.random.uniform(65, 75) 
-            base_vib = np.random.uniform(0.5, 1.5)
-
-        base_load = np.random.uniform(5, 8)
-        
-        for i in range(100):
-            timestamp = now - timedelta(seconds=(100-i)*2)
-            temp = base_temp + np.random.normal(0, 1.0)
-            vib = base_vib + np.random.normal(0, 0.1)
-            load = base_load + np.random.normal(0, 0.2) + np.sin(i/10)*2
-            
-            status = 'Running'
-            if temp > 80 or vib > 5: status = 'Error'
-            elif temp > 70 or vib > 3: status = 'Warning'
-            
-            data.append({
-                'Timestamp': timestamp,
-                'Robot_ID': robot,
-                'Motor_Temperature': temp,
-                'Vibration_Level': max(0, vib),
-                'Current_Load': max(0, load),
-                'Status': status
-            })
-    
-    return pd.DataFrame(data)
-
-def generate_next_step(current_df):
-    """生成下一秒的实时数据"""
-    last_timestamp = current_df['Timestamp'].max()
-    new_timestamp = last_timestamp + timedelta(seconds=2)
-    
-    new_rows = []
-    latest_readings = current_df.sort_values('Timestamp').groupby('Robot_ID').last()
-    
-    for robot in ROBOTS:
-        last_row = latest_readings.loc[robot]
-        current_temp = last_row['Motor_Temperature']
-        current_vib = last_row['Vibration_Level']
-        
-        # 保持之前的自愈逻辑
-        change = np.random.normal(0, 0.4) 
-        if current_temp > 82: change -= 1.2
-        elif current_temp > 72: change -= 0.6
-        elif current_temp < 40: change += 0.5
-            
-        new_temp = current_temp + change
-        
-        if current_vib > 4: new_vib = current_vib * 0.8
-        elif np.random.random() < 0.01: new_vib = current_vib + np.random.uniform(2, 3)
-        else: new_vib = current_vib * 0.95 + np.random.normal(0.2, 0.05)
-            
-        seconds = new_timestamp.timestamp()
-        new_load = 6 + 3 * np.sin(seconds / 20) + np.random.normal(0, 0.1)
-        
-        status = 'Running'
-        if new_temp > 80 or new_vib > 5: status = 'Error'
-        elif new_temp > 70 or new_vib > 3: status = 'Warning'
-            
-        new_rows.append({
-            'Timestamp': new_timestamp,
-            'Robot_ID': robot,
-            'Motor_Temperature': new_temp,
-            'Vibration_Level': max(0, new_vib),
-            'Current_Load': max(0, new_load),
-            'Status': status
-        })
-        
-    return pd.DataFrame(new_rows)
+# 模拟引擎 (环形缓冲区、随机数池、单步更新) 放在 core/sensor_sim.py：模块只导入一次，页面每次重跑不再重新定义
+
+# 趋势图显示整个环形缓冲区 (TREND_WINDOW 个采样)；超过 TREND_MAX_POINTS (大约是图表的像素宽度) 时先用 LTTB 降采样
+TREND_WINDOW = WINDOW
+TREND_MAX_POINTS = 200
+
+def build_trend_figure():
+    """趋势图骨架 (轨迹样式、布局、阈值线) 每个会话只构建一次"""
+    # 两个子图直接用 y / y2 两条纵轴的 domain 上下排列，共用一条横轴：
+    # 不走 make_subplots 的网格推算，阈值线也直接写成 layout.shapes，不用 add_hline 逐条追加
+    return go.Figure(
+        data=[
+            go.Scattergl(
+                x=[], y=[],
+                mode='lines', name='温度', line=dict(color='#00d4ff', width=2),
+                fill='tozeroy', fillcolor='rgba(0, 212, 255, 0.1)'
+            ),
+            go.Scattergl(
+                x=[], y=[],
+                mode='lines', name='振动', line=dict(color='#00ff41', width=2),
+                fill='tozeroy', fillcolor='rgba(0, 255, 65, 0.1)',
+                yaxis='y2'
+            ),
+        ],
+        layout=dict(
+            height=400,
+            margin=dict(l=0, r=0, t=20, b=0),
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            showlegend=False,
+            font=dict(color='white'),
+            xaxis=dict(anchor='y2', showgrid=False),
+            yaxis=dict(domain=[0.55, 1.0], showgrid=True, gridcolor='rgba(255,255,255,0.1)'),
+            yaxis2=dict(domain=[0.0, 0.45], showgrid=True, gridcolor='rgba(255,255,255,0.1)'),
+            shapes=[
+                dict(type='line', xref='x domain', x0=0, x1=1, yref='y', y0=80, y1=80,
+                     line=dict(color='red', dash='dash')),
+                dict(type='line', xref='x domain', x0=0, x1=1, yref='y2', y0=5, y1=5,
+                     line=dict(color='red', dash='dash')),
+            ],
+            annotations=[
+                dict(text='高温阈值', xref='x domain', x=1, yref='y', y=80,
+                     showarrow=False, xanchor='right', yanchor='bottom'),
+                dict(text='振动阈值', xref='x domain', x=1, yref='y2', y=5,
+                     showarrow=False, xanchor='right', yanchor='bottom'),
+            ],
+        )
+    )
 
 # ==================== 2. 状态管理 ====================
 
-if 'sensor_data' not in st.session_state:
-    st.session_state.sensor_data = init_simulation_data()
+if 'sensor_buffer' not in st.session_state:
+    st.session_state.sensor_buffer = init_buffer()
     st.session_state.is_running = True
+if 'trend_fig' not in st.session_state:
+    # 放 session_state 而不是 st.cache_resource：每个 tick 都要原地改数据，跨会话共享同一个对象会互相覆盖
+    st.session_state.trend_fig = build_trend_figure()
 
 # 侧边栏控制区
 st.sidebar.markdown("### 🎮 模拟器控制台")
@@ -111,13 +84,28 @@ auto_refresh = st.sidebar.toggle('⏱️ 开启实时数据流', value=True)
 # === 关键修改在这里：默认值从 1.0 改成了 3.0 ===
 refresh_rate = st.sidebar.slider('刷新频率 (秒)', 0.5, 5.0, 3.0)
 
-if auto_refresh:
-    new_data = generate_next_step(st.session_state.sensor_data)
-    st.session_state.sensor_data = pd.concat([st.session_state.sensor_data, new_data], ignore_index=True)
-    if len(st.session_state.sensor_data) > 2500:
-        st.session_state.sensor_data = st.session_state.sensor_data.iloc[-2500:]
-
-df = st.session_state.sensor_data
+def _ensure_producer(interval):
+    """每个会话只启动一个模拟线程；间隔随滑块实时更新"""
+    buf = st.session_state.sensor_buffer
+    buf['interval'] = interval
+    worker = st.session_state.get('sim_producer')
+    if worker is not None and worker[0].is_alive():
+        return
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_producer, args=(buf, stop_event), daemon=True)
+    thread.start()
+    st.session_state.sim_producer = (thread, stop_event)
+
+def _stop_producer():
+    worker = st.session_state.pop('sim_producer', None)
+    if worker is not None:
+        worker[1].set()
+
+if not auto_refresh:
+    _stop_producer()
+
+# 侧边栏控件必须放在片段外面 (片段内不能写 st.sidebar)
+selected_robot = st.sidebar.selectbox("选择监控对象", ROBOTS, index=0)
 
 # ==================== 3. 界面渲染 ====================
 
@@ -136,109 +124,126 @@ st.markdown("""
     .status-error { border-color: #ff0000; box-shadow: 0 0 15px rgba(255, 0, 0, 0.2); }
     .robot-name { font-size: 18px; font-weight: bold; color: #fff; }
     .metric-value { font-size: 14px; color: #b0b0b0; }
+    .card-row { display: flex; gap: 1rem; margin-bottom: 1rem; }
+    .card-row .metric-card { flex: 1; }
 </style>
 """, unsafe_allow_html=True)
 
+# 卡片模板只定义一次，每个 tick 只做 format 填值
+CARD_TMPL = (
+    '<div class="metric-card {cls}">'
+    '<div class="robot-name">{rid}</div>'
+    '<div style="font-size: 20px; font-weight: bold; color: {color}; margin: 10px 0;">{icon} {status}</div>'
+    '<div class="metric-value">温度: {t:.1f}°C</div>'
+    '<div class="metric-value">振动: {v:.2f} mm/s</div>'
+    '<div class="metric-value">负载: {l:.2f} A</div>'
+    '</div>'
+)
+# 按状态编码 (RUNNING / WARNING / ERROR) 直接下标查表
+CARD_STYLES = (
+    dict(cls='status-running', color='#00ff41', icon='✓'),
+    dict(cls='status-warning', color='#ffd700', icon='⚠'),
+    dict(cls='status-error', color='#ff0000', icon='✕'),
+)
+
+# 预警条目同样用模板；按 (是否 Error) 查颜色
+ALERT_TMPL = (
+    '<div style="background-color: {bg}; padding: 10px; border-radius: 5px; margin-bottom: 8px; border-left: 4px solid {color};">'
+    '<div style="display: flex; justify-content: space-between;">'
+    '<span style="color: #fff; font-weight: bold;">{rid}</span>'
+    '<span style="color: #ccc; font-size: 12px;">{ts}</span>'
+    '</div>'
+    '<div style="color: {color}; margin-top: 4px; font-size: 14px;">{status}: Temp {t:.1f}°C | Vib {v:.2f}</div>'
+    '</div>'
+)
+ALERT_STYLES = (
+    dict(color='#ffa421', bg='rgba(255, 164, 33, 0.1)'),
+    dict(color='#ff4b4b', bg='rgba(255, 75, 75, 0.1)'),
+)
+
+# 标题是静态内容，放在片段外面只渲染一次；时钟交给浏览器每秒自己走，服务端不再为它重跑
+CLOCK_HTML = """
+<h3 id="clk" style="margin: 0; text-align: right; color: #00d4ff; font-family: 'Arial', sans-serif;"></h3>
+<script>
+    const clk = document.getElementById('clk');
+    const tick = () => { clk.textContent = new Date().toLocaleTimeString('zh-CN', {hour12: false}); };
+    tick();
+    setInterval(tick, 1000);
+</script>
+"""
+
 col_title, col_time = st.columns([3, 1])
 with col_title:
     st.markdown("## 🏭 工业智脑综合管理平台 (Live Monitor)")
 with col_time:
-    st.markdown(f"<h3 style='text-align: right; color: #00d4ff;'>{datetime.now().strftime('%H:%M:%S')}</h3>", unsafe_allow_html=True)
+    components.html(CLOCK_HTML, height=50)
 
 st.markdown("---")
 
-st.markdown("### 📊 实时设备状态")
-latest_data = df.sort_values('Timestamp').groupby('Robot_ID').last().reset_index()
-
-cols = st.columns(5)
-for idx, row in latest_data.iterrows():
-    col_idx = idx % 5
-    status = row['Status']
-    
-    if status == 'Running':
-        s_class, s_color, s_icon = 'status-running', '#00ff41', '✓'
-    elif status == 'Warning':
-        s_class, s_color, s_icon = 'status-warning', '#ffd700', '⚠'
-    else:
-        s_class, s_color, s_icon = 'status-error', '#ff0000', '✕'
-    
-    with cols[col_idx]:
-        st.markdown(f"""
-        <div class="metric-card {s_class}">
-            <div class="robot-name">{row['Robot_ID']}</div>
-            <div style="font-size: 20px; font-weight: bold; color: {s_color}; margin: 10px 0;">
-                {s_icon} {status}
-            </div>
-            <div class="metric-value">温度: {row['Motor_Temperature']:.1f}°C</div>
-            <div class="metric-value">振动: {row['Vibration_Level']:.2f} mm/s</div>
-            <div class="metric-value">负载: {row['Current_Load']:.2f} A</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-col_chart, col_alert = st.columns([2, 1])
-
-with col_chart:
-    st.markdown("### 📈 实时趋势监控")
-    selected_robot = st.sidebar.selectbox("选择监控对象", ROBOTS, index=0)
-    
-    robot_df = df[df['Robot_ID'] == selected_robot].tail(100)
-    
-    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, 
-                        vertical_spacing=0.1, row_heights=[0.5, 0.5])
-    
-    fig.add_trace(go.Scatter(
-        x=robot_df['Timestamp'], y=robot_df['Motor_Temperature'],
-        mode='lines', name='温度', line=dict(color='#00d4ff', width=2),
-        fill='tozeroy', fillcolor='rgba(0, 212, 255, 0.1)'
-    ), row=1, col=1)
-    
-    fig.add_trace(go.Scatter(
-        x=robot_df['Timestamp'], y=robot_df['Vibration_Level'],
-        mode='lines', name='振动', line=dict(color='#00ff41', width=2),
-        fill='tozeroy', fillcolor='rgba(0, 255, 65, 0.1)'
-    ), row=2, col=1)
-    
-    fig.add_hline(y=80, line_dash="dash", line_color="red", row=1, col=1, annotation_text="高温阈值")
-    fig.add_hline(y=5, line_dash="dash", line_color="red", row=2, col=1, annotation_text="振动阈值")
-
-    fig.update_layout(
-        height=400,
-        margin=dict(l=0, r=0, t=20, b=0),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        showlegend=False,
-        font=dict(color='white')
-    )
-    fig.update_xaxes(showgrid=False)
-    fig.update_yaxes(showgrid=True, gridcolor='rgba(255,255,255,0.1)')
-    
-    st.plotly_chart(fig, use_container_width=True)
-
-with col_alert:
-    st.markdown("### ⚠️ 实时预警日志")
-    alerts = df[df['Status'].isin(['Warning', 'Error'])].sort_values('Timestamp', ascending=False).head(10)
-    
-    if not alerts.empty:
-        for _, row in alerts.iterrows():
-            color = "#ff4b4b" if row['Status'] == 'Error' else "#ffa421"
-            bg_color = "rgba(255, 75, 75, 0.1)" if row['Status'] == 'Error' else "rgba(255, 164, 33, 0.1)"
-            
-            st.markdown(f"""
-            <div style="background-color: {bg_color}; padding: 10px; border-radius: 5px; margin-bottom: 8px; border-left: 4px solid {color};">
-                <div style="display: flex; justify-content: space-between;">
-                    <span style="color: #fff; font-weight: bold;">{row['Robot_ID']}</span>
-                    <span style="color: #ccc; font-size: 12px;">{row['Timestamp'].strftime('%H:%M:%S')}</span>
-                </div>
-                <div style="color: {color}; margin-top: 4px; font-size: 14px;">
-                    {row['Status']}: Temp {row['Motor_Temperature']:.1f}°C | Vib {row['Vibration_Level']:.2f}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-    else:
-        st.info("✅ 系统运行平稳，暂无异常")
-
-# ==================== 4. 自动刷新逻辑 ====================
-
-if auto_refresh:
-    time.sleep(refresh_rate)
-    st.rerun()
+# 只有这个片段按刷新频率局部重跑：CSS、侧边栏、标题不再跟着每个 tick 重新执行
+# 卡片 / 趋势图 / 预警日志共用这一个片段：同一个 tick 只推进一次模拟，拆成多个各自计时的片段会读到不同步的数据
+@st.fragment(run_every=refresh_rate if auto_refresh else None)
+def live_dashboard():
+    # 模拟在后台线程里按固定节奏推进，片段只读最新快照：渲染慢了也不会拖慢模拟
+    # (每次都检查一下：会话闲置太久线程会自行退出，这里负责拉起来)
+    if auto_refresh:
+        _ensure_producer(refresh_rate)
+    # 快照已按时间排好序，最后一列就是最新读数，不用 sort + groupby
+    snap = snapshot(st.session_state.sensor_buffer)
+
+    st.markdown("### 📊 实时设备状态")
+    latest_status = snap['status'][:, -1]
+    latest_temp = snap['temp'][:, -1]
+    latest_vib = snap['vib'][:, -1]
+    latest_load = snap['load'][:, -1]
+
+    parts = [
+        CARD_TMPL.format(
+            rid=robot_id, status=STATUS_NAMES[latest_status[idx]], **CARD_STYLES[latest_status[idx]],
+            t=latest_temp[idx], v=latest_vib[idx], l=latest_load[idx],
+        )
+        for idx, robot_id in enumerate(ROBOTS)
+    ]
+    # 5 张卡片拼成一段 HTML、一次 markdown 发出去，不再每个 tick 建 5 个 column 容器
+    st.markdown('<div class="card-row">' + ''.join(parts) + '</div>', unsafe_allow_html=True)
+
+    col_chart, col_alert = st.columns([2, 1])
+
+    with col_chart:
+        st.markdown("### 📈 实时趋势监控")
+        # 单台机器人的历史就是对应的一行，不用布尔掩码筛整张表
+        r = ROBOTS.index(selected_robot)
+        # 时间轴直接给 datetime64[ms] 数组 (Plotly.js 的日期精度)，数值轴是 float32 的行视图
+        trend_ts = snap['ts'][-TREND_WINDOW:].astype('datetime64[ms]')
+
+        # 骨架复用，每个 tick 只替换两条轨迹的数据数组；发出去的点数只和图表宽度有关，不随窗口变大
+        fig = st.session_state.trend_fig
+        for trace, key in zip(fig.data, ('temp', 'vib')):
+            y = snap[key][r, -TREND_WINDOW:]
+            keep = lttb_indices(trend_ts, y, TREND_MAX_POINTS)
+            trace.x = trend_ts[keep]
+            trace.y = y[keep]
+
+        # 固定 key：前端按同一个元素原地更新图表，不会每个 tick 重新挂载
+        # 持续刷新的看板不需要工具栏和滚轮缩放，少一层鼠标事件处理
+        st.plotly_chart(fig, use_container_width=True, key='trend_chart',
+                        config={'displayModeBar': False, 'scrollZoom': False})
+
+    with col_alert:
+        st.markdown("### ⚠️ 实时预警日志")
+        # 预警在写入缓冲区时就记好了 (旧 → 新)，倒过来就是从新到旧，不用过滤 + 排序整个历史
+        alerts = snap['alerts'][::-1]
+
+        if alerts:
+            rows = [
+                ALERT_TMPL.format(
+                    **ALERT_STYLES[int(status == ERROR)], rid=ROBOTS[r], ts=ts.item().strftime('%H:%M:%S'),
+                    status=STATUS_NAMES[status], t=temp, v=vib,
+                )
+                for ts, r, status, temp, vib in alerts
+            ]
+            st.markdown(''.join(rows), unsafe_allow_html=True)
+        else:
+            st.info("✅ 系统运行平稳，暂无异常")
+
+live_dashboard()
@@ -1,13 +1,18 @@
-import json
-import time
 from datetime import datetime
 import random
 import re
 
+import numpy as np
+
+# 温度波动噪声池：NumPy 一次性生成，每次模拟按游标顺序取值，不再逐台机器人调用 random.uniform
+FLUCTUATION_POOL = 4096
+_FLUCTUATIONS = np.random.default_rng().uniform(-0.5, 0.5, FLUCTUATION_POOL).tolist()
+
 class RobotController:
     def __init__(self, num_robots=5):
         self.num_robots = num_robots
         self.robots = {}
+        self._cursor = 0
         self._initialize_robots()
 
     def _initialize_robots(self):
@@ -102,6 +107,8 @@ class RobotController:
         except Exception as e: return {"success": False, "message": str(e)}
 
     def _simulate_fluctuation(self):
-        for r_id, data in self.robots.items():
+        for data in self.robots.values():
             if data["status"] == "Running":
-                data["temperature"] = round(data["temperature"] + random.uniform(-0.5, 0.5), 1)
\ No newline at end of file
+                jitter = _FLUCTUATIONS[self._cursor % FLUCTUATION_POOL]
+                self._cursor += 1
+                data["temperature"] = round(data["temperature"] + jitter, 1)
\ No newline at end of file
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import pytest
+
+from core.rag_bridge import _ZhipuEmbeddingImpl
+
+
+class _APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class _FakeEmbeddings:
+    """按输入内容决定返回向量还是抛错，并记下请求次数"""
+
+    def __init__(self, fail_on=None, status_code=400):
+        self.fail_on = fail_on
+        self.status_code = status_code
+        self.calls = 0
+
+    def create(self, model, input):
+        self.calls += 1
+        if self.fail_on is None or self.fail_on in input:
+            raise _APIError(self.status_code)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0]) for _ in input])
+
+
+def _embedding(fake):
+    embedding = _ZhipuEmbeddingImpl.__new__(_ZhipuEmbeddingImpl)
+    embedding.client = SimpleNamespace(embeddings=fake)
+    return embedding
+
+
+def test_bad_chunk_is_isolated_not_zero_filled():
+    texts = [f"t{i}" for i in range(8)]
+    embedding = _embedding(_FakeEmbeddings(fail_on="t5"))
+    result = embedding.embed_documents_or_none(texts)
+    assert result[5] is None
+    assert all(e == [1.0] for i, e in enumerate(result) if i != 5)
+    with pytest.raises(ValueError):
+        embedding.embed_documents(texts)
+
+
+def test_auth_error_raises_without_splitting():
+    fake = _FakeEmbeddings(status_code=401)
+    with pytest.raises(_APIError):
+        _embedding(fake).embed_documents_or_none([f"t{i}" for i in range(8)])
+    assert fake.calls == 1
+
+
+class _FakeCollection:
+    def __init__(self):
+        self.upserted = None
+
+    def upsert(self, ids, embeddings, documents):
+        self.upserted = ids
+
+
+class _FakeDB:
+    """0 号片段已正常入库，1 号是旧版本兜底写入的全零向量"""
+
+    def __init__(self):
+        self._collection = _FakeCollection()
+
+    def get(self, ids, include):
+        return {"ids": ["h:0", "h:1"], "embeddings": [[1.0], [0.0]]}
+
+
+def test_build_drops_failed_chunks_and_repairs_zero_vectors(monkeypatch):
+    import core.rag_bridge as rag_bridge
+
+    db = _FakeDB()
+    monkeypatch.setattr(rag_bridge, "_open_db", lambda _: db)
+    monkeypatch.setattr(rag_bridge, "get_embedding", lambda: _embedding(_FakeEmbeddings(fail_on="c2")))
+    msg = rag_bridge.build_vector_store(["c0", "c1", "c2", "c3"], doc_hash="h")
+    assert db._collection.upserted == ["h:1", "h:3"]
+    assert msg.startswith("⚠️")
@@ -0,0 +1,20 @@
+from core.semantic_cache import is_cacheable_command
+
+
+def test_self_contained_command_is_cacheable():
+    assert is_cacheable_command("启动1号机器人", [1])
+    assert is_cacheable_command("急停 2号和3号", [2, 3])
+
+
+def test_context_dependent_commands_are_not_cached():
+    # 指代上文 / 依赖当前状态：同一句话下次可能指向别的机器人
+    assert not is_cacheable_command("停止它", [2])
+    assert not is_cacheable_command("同上", [2])
+    assert not is_cacheable_command("启动所有停止的机器人", [1, 4])
+    assert not is_cacheable_command("把2号速度调到和1号一样", [2])
+
+
+def test_tool_calls_must_match_the_named_robots():
+    # 模型实际操作的机器人不是原文点名的那台 (例如结合了历史)，不能按原文缓存
+    assert not is_cacheable_command("启动1号", [2])
+    assert not is_cacheable_command("启动1号", [None])
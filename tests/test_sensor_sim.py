@@ -0,0 +1,40 @@
+import numpy as np
+
+from core.sensor_sim import (TICK, WARNING, WINDOW, generate_next_step, init_buffer, lttb_indices,
+                             ordered)
+
+
+def _series(n, seed=0):
+    ts = np.datetime64('2024-01-01T00:00:00', 's') + np.arange(n) * np.timedelta64(2, 's')
+    y = np.random.default_rng(seed).normal(50, 1, n).astype(np.float32)
+    return ts.astype('datetime64[ms]'), y
+
+
+def test_lttb_identity_within_budget():
+    ts, y = _series(150)
+    np.testing.assert_array_equal(lttb_indices(ts, y, 200), np.arange(150))
+
+
+def test_lttb_downsamples_to_budget():
+    ts, y = _series(500)
+    keep = lttb_indices(ts, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == 499
+    assert np.all(np.diff(keep) > 0)   # 严格递增，时间轴不会乱序
+
+
+def test_lttb_keeps_spike():
+    ts, y = _series(500)
+    y[321] = 95.0   # 单点尖峰 (超温) 降采样后必须还在
+    assert 321 in lttb_indices(ts, y, 200)
+
+
+def test_alerts_are_evicted_with_overwritten_columns():
+    buf = init_buffer()
+    for _ in range(WINDOW):
+        generate_next_step(buf)
+    # 一条刚好落在被覆盖的那一列上的预警
+    buf['alerts'].appendleft((ordered(buf, 'ts')[0] - TICK, 0, WARNING, 75.0, 1.0))
+    generate_next_step(buf)
+    oldest = ordered(buf, 'ts')[0]
+    assert all(alert[0] >= oldest for alert in buf['alerts'])